@@ -23,6 +23,7 @@ Requirements:
 
 Usage:
     $ python benchmarks.py --weights yolov5s.pt --img 640
+    $ python benchmarks.py --weights yolov5s_SpatialIE.pt --img 640 --latency  # CPU latency and parity, no dataset
 """
 
 import argparse
@@ -32,6 +33,7 @@ import time
 from pathlib import Path
 
 import pandas as pd
+import torch
 
 FILE = Path(__file__).resolve()
 ROOT = FILE.parents[0]  # YOLOv5 root directory
@@ -40,12 +42,12 @@ if str(ROOT) not in sys.path:
 # ROOT = ROOT.relative_to(Path.cwd())  # relative
 
 import export
+from models.common import DetectMultiBackend
 from models.experimental import attempt_load
 from models.yolo import SegmentationModel
-from segment.val import run as val_seg
 from utils import notebook_init
 from utils.general import LOGGER, check_yaml, file_size, print_args
-from utils.torch_utils import select_device
+from utils.torch_utils import select_device, time_sync
 from val import run as val_det
 
 
@@ -83,6 +85,8 @@ def run(
 
             # Validate
             if model_type == SegmentationModel:
+                from segment.val import run as val_seg
+
                 result = val_seg(data, w, batch_size, imgsz, plots=False, device=device, task="speed", half=half)
                 metric = result[0][7]  # (box(p, r, map50, map), mask(p, r, map50, map), *loss(box, obj, cls))
             else:  # DetectionModel:
@@ -148,6 +152,55 @@ def test(
     return py
 
 
+def latency(
+    weights=ROOT / "yolov5s.pt",  # weights path
+    imgsz=640,  # inference size (pixels)
+    batch_size=1,  # batch size
+    device="cpu",  # cuda device, i.e. 0 or 0,1,2,3 or cpu
+    half=False,  # use FP16 half-precision inference
+    runs=20,  # timed runs per format
+    formats=("torchscript", "onnx", "openvino"),  # export formats to compare with PyTorch
+    **kwargs,
+):
+    # Inference latency and output parity of export formats vs PyTorch on random images, no dataset required
+    y, t = [], time.time()
+    device = select_device(device)
+    im = torch.rand(batch_size, 3, imgsz, imgsz, device=device)
+    im = im.half() if half else im
+    ref = None
+    for name, f, suffix, cpu, gpu in export.export_formats().itertuples(index=False):
+        if f != "-" and f not in formats:
+            continue
+        try:
+            w = weights if f == "-" else export.run(
+                weights=weights, imgsz=[imgsz], include=[f], batch_size=batch_size, device=device, half=half,
+                parity=False
+            )[-1]
+            model = DetectMultiBackend(w, device=device, fp16=half)
+            model.warmup(imgsz=im.shape)
+            out = model(im)
+            out = (out[0] if isinstance(out, (list, tuple)) else out).float()
+            ref = out if ref is None else ref  # PyTorch first
+            dt = []
+            for _ in range(runs):
+                t0 = time_sync()
+                model(im)
+                dt.append((time_sync() - t0) * 1e3)
+            ms = sorted(dt)[len(dt) // 2]  # median
+            diff = (torch.as_tensor(out, device=ref.device) - ref).abs().max().item()
+            y.append([name, round(file_size(w), 1), round(ms, 2), diff])
+        except Exception as e:
+            LOGGER.warning(f"WARNING ⚠️ Latency benchmark failure for {name}: {e}")
+            y.append([name, None, None, None])
+
+    py = pd.DataFrame(y, columns=["Format", "Size (MB)", "Latency (ms)", "Max abs diff"])
+    ms = py["Latency (ms)"].tolist()  # PyTorch first, None on failure
+    py.insert(3, "Speedup", ["-" if pd.isna(ms[0]) or pd.isna(x) else round(ms[0] / x, 2) for x in ms])
+    LOGGER.info(f"\nLatency benchmarks complete ({time.time() - t:.2f}s), median of {runs} runs at {tuple(im.shape)}")
+    LOGGER.info(str(py))
+    return py
+
+
 def parse_opt():
     parser = argparse.ArgumentParser()
     parser.add_argument("--weights", type=str, default=ROOT / "yolov5s.pt", help="weights path")
@@ -159,14 +212,19 @@ def parse_opt():
     parser.add_argument("--test", action="store_true", help="test exports only")
     parser.add_argument("--pt-only", action="store_true", help="test PyTorch only")
     parser.add_argument("--hard-fail", nargs="?", const=True, default=False, help="Exception on error or < min metric")
+    parser.add_argument("--latency", action="store_true", help="TorchScript/ONNX/OpenVINO latency and parity only")
     opt = parser.parse_args()
-    opt.data = check_yaml(opt.data)  # check YAML
+    opt.data = opt.data if opt.latency else check_yaml(opt.data)  # check YAML, --latency needs no dataset
     print_args(vars(opt))
     return opt
 
 
 def main(opt):
-    test(**vars(opt)) if opt.test else run(**vars(opt))
+    if opt.latency:
+        latency(**vars(opt))
+    else:
+        del opt.latency
+        test(**vars(opt)) if opt.test else run(**vars(opt))
 
 
 if __name__ == "__main__":
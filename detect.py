@@ -47,6 +47,7 @@ ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 from ultralytics.utils.plotting import Annotator, colors, save_one_box
 
 from models.common import DetectMultiBackend
+from models.modules import SpatialIE
 from utils.dataloaders import IMG_FORMATS, VID_FORMATS, LoadImages, LoadScreenshots, LoadStreams
 from utils.general import (
     LOGGER,
@@ -97,6 +98,11 @@ def run(
     half=False,  # use FP16 half-precision inference
     dnn=False,  # use OpenCV DNN for ONNX inference
     vid_stride=1,  # video frame-rate stride
+    enhance_tile=0,  # SpatialIE tiled inference tile size (pixels), 0 for full-frame
+    enhance_overlap=32,  # SpatialIE tile overlap (pixels)
+    enhance_gate=0.0,  # SpatialIE bypass gate threshold, 0 to always enhance
+    enhance_stream=0,  # SpatialIE video deep feature refresh interval (frames), 0 to recompute every frame
+    enhance_scene_thres=0.05,  # SpatialIE scene-change threshold forcing a refresh
 ):
     source = str(source)
     save_img = not nosave and not source.endswith(".txt")  # save inference images
@@ -116,6 +122,18 @@ def run(
     model = DetectMultiBackend(weights, device=device, dnn=dnn, data=data, fp16=half)
     stride, names, pt = model.stride, model.names, model.pt
     imgsz = check_img_size(imgsz, s=stride)  # check image size
+    if pt and enhance_tile:  # memory-bounded enhancer for high-resolution inputs
+        for m in model.model.modules():
+            if isinstance(m, SpatialIE):
+                m.tiling(enhance_tile, enhance_overlap)
+    if pt and enhance_gate:  # route clean frames around the enhancer
+        for m in model.model.modules():
+            if isinstance(m, SpatialIE):
+                m.gating(enhance_gate)
+    if pt and enhance_stream:  # reuse deep enhancer features across video frames
+        for m in model.model.modules():
+            if isinstance(m, SpatialIE):
+                m.streaming(enhance_stream, enhance_scene_thres)
     
     
 
@@ -259,6 +277,11 @@ def run(
     # Print results
     t = tuple(x.t / seen * 1e3 for x in dt)  # speeds per image
     LOGGER.info(f"Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS per image at shape {(1, 3, *imgsz)}" % t)
+    if pt and enhance_gate:
+        for m in model.model.modules():
+            if isinstance(m, SpatialIE):
+                n, nb = m.gate_stats
+                LOGGER.info(f"SpatialIE gate {enhance_gate:g}: {nb}/{n} images bypassed ({nb / max(n, 1):.1%})")
     if save_txt or save_img:
         s = f"\n{len(list(save_dir.glob('labels/*.txt')))} labels saved to {save_dir / 'labels'}" if save_txt else ""
         LOGGER.info(f"Results saved to {colorstr('bold', save_dir)}{s}")
@@ -296,6 +319,15 @@ def parse_opt():
     parser.add_argument("--half", action="store_true", help="use FP16 half-precision inference")
     parser.add_argument("--dnn", action="store_true", help="use OpenCV DNN for ONNX inference")
     parser.add_argument("--vid-stride", type=int, default=1, help="video frame-rate stride")
+    parser.add_argument("--enhance-tile", type=int, default=0, help="SpatialIE tiled inference tile size, 0 to disable")
+    parser.add_argument("--enhance-overlap", type=int, default=32, help="SpatialIE tile overlap (pixels)")
+    parser.add_argument("--enhance-gate", type=float, default=0.0, help="SpatialIE bypass gate threshold, 0 to disable")
+    parser.add_argument(
+        "--enhance-stream", type=int, default=0, help="SpatialIE video feature refresh interval, 0 to disable"
+    )
+    parser.add_argument(
+        "--enhance-scene-thres", type=float, default=0.05, help="SpatialIE scene-change refresh threshold"
+    )
     opt = parser.parse_args()
     opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
     print_args(vars(opt))
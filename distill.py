@@ -0,0 +1,125 @@
+# YOLOv5 🚀 by Ultralytics, AGPL-3.0 license
+"""
+Distill the trained KAN layers of a SpatialIE detector into deployable replacements.
+
+Inputs of every KANLinear are recorded on --calib training images, then each layer is replaced by the smallest
+candidate whose maximum absolute output error on held-out recorded inputs is within --max-error:
+    poly: per-edge piecewise polynomial (KANPolyLinear), elementwise ops and one matmul
+    mlp: Linear-SiLU-Linear stack, also quantized by quantize.py
+Layers without a candidate within budget stay KANLinear. FP32 and distilled models are then compared with val.py.
+
+Usage:
+    $ python distill.py --weights yolov5s_SpatialIE.pt --data coco128.yaml --img 640
+    $ python distill.py --weights yolov5s_SpatialIE.pt --data coco128.yaml --method mlp --max-error 0.05
+
+Outputs yolov5s_SpatialIE-distilled.pt, usable with val.py, detect.py and export.py --include torchscript onnx openvino.
+"""
+
+import argparse
+import math
+import sys
+from copy import deepcopy
+from pathlib import Path
+
+import torch
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+# ROOT = ROOT.relative_to(Path.cwd())  # relative
+
+from models.experimental import attempt_load
+from models.modules.KAN import KAN, distill_kan_linear
+from utils.compression import calibration_batches, compare_models
+from utils.general import LOGGER, check_dataset, check_img_size, colorstr, file_size, print_args
+from utils.torch_utils import select_device
+
+
+@torch.no_grad()
+def record_inputs(model, batches, tokens=65536):
+    # Returns {(name, KAN, index): (tokens, in_features)} inputs of every KANLinear, sampled evenly over image batches
+    kans = [(k, m) for k, m in model.named_modules() if isinstance(m, KAN)]
+    layers = {(f"{k}.layers.{i}", m, i): x for k, m in kans for i, x in enumerate(m.layers)}
+    inputs = {k: [] for k in layers}
+    per_batch = math.ceil(tokens / len(batches))
+    hook = lambda k: lambda m, a: inputs[k].append(a[0][torch.randperm(len(a[0]), device=a[0].device)[:per_batch]])
+    handles = [x.register_forward_pre_hook(hook(k)) for k, x in layers.items()]
+    for x in batches:
+        model(x)
+    for h in handles:
+        h.remove()
+    return {k: torch.cat(v)[:tokens] for k, v in inputs.items()}
+
+
+def run(
+    weights=ROOT / "yolov5s.pt",  # weights path
+    data=ROOT / "data/coco128.yaml",  # dataset.yaml path
+    imgsz=640,  # inference size (pixels)
+    batch_size=8,  # calibration and val batch size
+    calib=64,  # calibration images from the train split
+    tokens=65536,  # recorded inputs per KAN layer
+    method="poly",  # replacement, poly or mlp
+    max_error=1e-2,  # max abs KAN layer output error
+    steps=2000,  # mlp training steps
+    device="",  # cuda device, i.e. 0 or cpu
+    workers=8,  # max dataloader workers
+    val=True,  # compare FP32 and distilled accuracy and speed with val.py
+):
+    # Model, FP32 with SpatialIE deployed
+    device = select_device(device, batch_size=batch_size)
+    model = attempt_load(weights, device=device, fuse=True).eval()
+    assert any(isinstance(m, KAN) for m in model.modules()), f"no KAN layers in {weights}"
+    gs = int(max(model.stride))
+    imgsz = check_img_size(imgsz, gs)
+    data = check_dataset(data)
+
+    # Calibration images
+    batches = calibration_batches(data["train"], imgsz, batch_size, gs, calib, workers)
+    batches = [x.to(device).float() / 255 for x in batches]
+
+    # Distill
+    fp32 = deepcopy(model)
+    inputs = record_inputs(model, batches, tokens)
+    LOGGER.info(f"\n{'layer':>32}{'in':>6}{'out':>6}{'max error':>12}  replacement")
+    for (k, kan, i), x in inputs.items():
+        layer = kan.layers[i]
+        kan.layers[i], error, s = distill_kan_linear(layer, x, method, max_error, steps)
+        LOGGER.info(f"{k:>32}{layer.in_features:>6}{layer.out_features:>6}{error:>12.2e}  {s}")
+
+    # Save, loads with attempt_load() like any checkpoint
+    f = Path(str(weights).replace(".pt", "-distilled.pt"))
+    torch.save({"model": deepcopy(model).cpu(), "epoch": -1, "distilled": method}, f)
+    LOGGER.info(f"\n{colorstr('distill:')} saved {f} ({file_size(f):.1f} MB)")
+
+    # Report, timed without autograd so KANLinear does not take its ChunkedKANLinear training path
+    compare_models({"KAN": fp32, "distilled": model}, batches[0], data, imgsz, batch_size, gs, workers, val)
+    return f
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--weights", type=str, default=ROOT / "yolov5s.pt", help="weights path")
+    parser.add_argument("--data", type=str, default=ROOT / "data/coco128.yaml", help="dataset.yaml path")
+    parser.add_argument("--imgsz", "--img", "--img-size", type=int, default=640, help="inference size (pixels)")
+    parser.add_argument("--batch-size", type=int, default=8, help="calibration and val batch size")
+    parser.add_argument("--calib", type=int, default=64, help="calibration images from the train split")
+    parser.add_argument("--tokens", type=int, default=65536, help="recorded inputs per KAN layer")
+    parser.add_argument("--method", default="poly", choices=["poly", "mlp"], help="KAN layer replacement")
+    parser.add_argument("--max-error", type=float, default=1e-2, help="max abs KAN layer output error")
+    parser.add_argument("--steps", type=int, default=2000, help="mlp training steps")
+    parser.add_argument("--device", default="", help="cuda device, i.e. 0 or cpu")
+    parser.add_argument("--workers", type=int, default=8, help="max dataloader workers")
+    parser.add_argument("--no-val", action="store_false", dest="val", help="skip KAN and distilled val.py comparison")
+    opt = parser.parse_args()
+    print_args(vars(opt))
+    return opt
+
+
+def main(opt):
+    run(**vars(opt))
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
@@ -0,0 +1,218 @@
+# YOLOv5 🚀 by Ultralytics, AGPL-3.0 license
+"""
+Run the SpatialIE image enhancer of a trained detector on images, videos, directories and globs.
+
+Decoding runs on a prefetching thread pool, frames of equal shape are enhanced in batches and outputs are encoded
+asynchronously, mirroring the source tree under runs/enhance/exp.
+
+Usage - sources:
+    $ python enhance.py --weights yolov5s_SpatialIE.pt --source img.jpg          # image
+                                                                 vid.mp4          # video
+                                                                 path/            # directory (recursive)
+                                                                 'path/*.jpg'     # glob
+
+Usage - Python:
+    from enhance import load_enhancer, run
+    model = load_enhancer('yolov5s_SpatialIE.pt')  # SpatialIE nn.Module, enhanced = model(im), im in 0-1 RGB
+    run(weights='yolov5s_SpatialIE.pt', source='path/', batch_size=8)
+"""
+
+import argparse
+import glob
+import os
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from queue import Queue
+from threading import Thread
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
+
+from models.experimental import attempt_load
+from models.modules import SpatialIE
+from utils.dataloaders import IMG_FORMATS, VID_FORMATS
+from utils.general import LOGGER, Profile, colorstr, cv2, increment_path, print_args
+from utils.torch_utils import select_device, smart_inference_mode
+
+
+def load_enhancer(weights, device=None, half=False):
+    # Load the SpatialIE enhancer out of a trained detector checkpoint, deployed for inference
+    model = attempt_load(weights, device=device, fuse=False)
+    enhancer = next((m for m in model.modules() if isinstance(m, SpatialIE)), None)
+    assert enhancer is not None, f"no SpatialIE enhancer found in {weights}"
+    enhancer = enhancer.deploy().eval()
+    return enhancer.half() if half else enhancer.float()
+
+
+def list_sources(source):
+    # Return (root, images, videos) for a file, directory (recursive) or glob source
+    p = str(Path(source).resolve())
+    if "*" in p:
+        files, root = sorted(glob.glob(p, recursive=True)), Path(os.path.dirname(p.split("*")[0]))
+    elif os.path.isdir(p):
+        files, root = sorted(glob.glob(os.path.join(p, "**", "*.*"), recursive=True)), Path(p)
+    elif os.path.isfile(p):
+        files, root = [p], Path(p).parent
+    else:
+        raise FileNotFoundError(f"{p} does not exist")
+    images = [x for x in files if x.split(".")[-1].lower() in IMG_FORMATS]
+    videos = [x for x in files if x.split(".")[-1].lower() in VID_FORMATS]
+    return root, images, videos
+
+
+def prefetch(fn, items, workers=4, depth=16):
+    # Ordered map of fn over items on a thread pool with at most depth results in flight
+    with ThreadPoolExecutor(workers) as pool:
+        q = deque()
+        for item in items:
+            q.append(pool.submit(fn, item))
+            if len(q) >= depth:
+                yield q.popleft().result()
+        while q:
+            yield q.popleft().result()
+
+
+def read_video(path, depth=16):
+    # Decode video frames on a background thread, yields BGR frames
+    q = Queue(depth)
+
+    def reader():
+        cap = cv2.VideoCapture(path)
+        while True:
+            ok, frame = cap.read()
+            q.put(frame if ok else None)
+            if not ok:
+                break
+        cap.release()
+
+    Thread(target=reader, daemon=True).start()
+    while (frame := q.get()) is not None:
+        yield frame
+
+
+def enhance_batches(model, frames, batch_size=8, dt=None):
+    # Enhance an iterable of (key, BGR uint8 image), yields (key, enhanced BGR uint8 image) in order. Consecutive
+    # frames of equal shape are batched, inputs are padded to multiples of the enhancer stride
+    p = next(model.parameters())
+    dt = dt or Profile()
+
+    def infer(batch):
+        with dt:
+            x = torch.from_numpy(np.stack([im for _, im in batch])).to(p.device).flip(-1)  # BGR to RGB
+            x = x.permute(0, 3, 1, 2).to(p.dtype) / 255  # uint8 to fp16/32, 0-255 to 0.0-1.0
+            h, w = x.shape[-2:]
+            ph, pw = -h % model.stride, -w % model.stride
+            if ph or pw:
+                x = F.pad(x, (0, pw, 0, ph), mode="replicate")
+            y = model(x)[..., :h, :w].clamp(0, 1).mul(255).round().byte()
+            y = y.permute(0, 2, 3, 1).flip(-1).contiguous().cpu().numpy()  # RGB to BGR
+        return [(key, im) for (key, _), im in zip(batch, y)]
+
+    batch = []
+    for item in frames:
+        if batch and (len(batch) == batch_size or item[1].shape != batch[0][1].shape):
+            yield from infer(batch)
+            batch = []
+        batch.append(item)
+    if batch:
+        yield from infer(batch)
+
+
+@smart_inference_mode()
+def run(
+    weights=ROOT / "yolov5s.pt",  # detector checkpoint containing a SpatialIE layer
+    source=ROOT / "data/images",  # file/dir/glob
+    batch_size=8,  # enhancer batch size
+    workers=8,  # decode and encode threads
+    device="",  # cuda device, i.e. 0 or 0,1,2,3 or cpu
+    half=False,  # use FP16 half-precision inference
+    tile=0,  # tiled inference tile size (pixels), 0 for full-frame
+    overlap=32,  # tile overlap (pixels)
+    compare=False,  # save input | enhanced side by side
+    project=ROOT / "runs/enhance",  # save results to project/name
+    name="exp",  # save results to project/name
+    exist_ok=False,  # existing project/name ok, do not increment
+):
+    device = select_device(device, batch_size=batch_size)
+    half &= device.type != "cpu"  # half precision only supported on CUDA
+    model = load_enhancer(weights, device=device, half=half)
+    if tile:
+        model.tiling(tile, overlap)
+    save_dir = increment_path(Path(project) / name, exist_ok=exist_ok)  # increment run
+    root, images, videos = list_sources(source)
+    LOGGER.info(f"{colorstr('enhance:')} {len(images)} images, {len(videos)} videos from {root}")
+
+    def out_path(f, suffix=None):
+        p = save_dir / Path(f).relative_to(root)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        return str(p.with_suffix(suffix) if suffix else p)
+
+    def output(im0, im):
+        return np.concatenate([im0, im], 1) if compare else im
+
+    def video_size(f):
+        cap = cv2.VideoCapture(f)
+        fps, w, h = cap.get(cv2.CAP_PROP_FPS), cap.get(cv2.CAP_PROP_FRAME_WIDTH), cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        cap.release()
+        return fps or 30, (int(w) * (1 + compare), int(h))
+
+    dt, seen = Profile(), 0
+    with ThreadPoolExecutor(workers) as encoder:
+        # Images, decoded ahead and encoded asynchronously
+        decoded = prefetch(lambda f: (f, cv2.imread(f)), images, workers, depth=batch_size * 4)
+        frames = (((f, im), im) for f, im in decoded if im is not None)  # keys carry the input for --compare
+        for (f, im0), im in enhance_batches(model, frames, batch_size, dt):
+            encoder.submit(cv2.imwrite, out_path(f), output(im0, im))
+            seen += 1
+
+        # Videos, frames written in order by one encoder thread per video
+        for f in videos:
+            fps, size = video_size(f)
+            writer = cv2.VideoWriter(out_path(f, ".mp4"), cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+            frames = ((im, im) for im in read_video(f, depth=batch_size * 4))
+            with ThreadPoolExecutor(1) as video_encoder:
+                for im0, im in enhance_batches(model, frames, batch_size, dt):
+                    video_encoder.submit(writer.write, output(im0, im))
+                    seen += 1
+            writer.release()
+
+    LOGGER.info(f"Speed: {dt.t / max(seen, 1) * 1e3:.1f}ms enhance per image, {seen / max(dt.t, 1e-9):.1f} images/s")
+    LOGGER.info(f"Results saved to {colorstr('bold', save_dir)}")
+    return save_dir
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--weights", type=str, default=ROOT / "yolov5s.pt", help="detector checkpoint with SpatialIE")
+    parser.add_argument("--source", type=str, default=ROOT / "data/images", help="file/dir/glob")
+    parser.add_argument("--batch-size", type=int, default=8, help="enhancer batch size")
+    parser.add_argument("--workers", type=int, default=8, help="decode and encode threads")
+    parser.add_argument("--device", default="", help="cuda device, i.e. 0 or 0,1,2,3 or cpu")
+    parser.add_argument("--half", action="store_true", help="use FP16 half-precision inference")
+    parser.add_argument("--tile", type=int, default=0, help="tiled inference tile size, 0 to disable")
+    parser.add_argument("--overlap", type=int, default=32, help="tile overlap (pixels)")
+    parser.add_argument("--compare", action="store_true", help="save input | enhanced side by side")
+    parser.add_argument("--project", default=ROOT / "runs/enhance", help="save results to project/name")
+    parser.add_argument("--name", default="exp", help="save results to project/name")
+    parser.add_argument("--exist-ok", action="store_true", help="existing project/name ok, do not increment")
+    opt = parser.parse_args()
+    print_args(vars(opt))
+    return opt
+
+
+def main(opt):
+    run(**vars(opt))
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
@@ -67,7 +67,9 @@ if str(ROOT) not in sys.path:
 if platform.system() != "Windows":
     ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 
+from models.common import DetectMultiBackend
 from models.experimental import attempt_load
+from models.modules import SpatialIE
 from models.yolo import ClassificationModel, Detect, DetectionModel, SegmentationModel
 from utils.dataloaders import LoadImages
 from utils.general import (
@@ -189,6 +191,7 @@ def export_onnx(model, im, file, opset, dynamic, simplify, prefix=colorstr("ONNX
         input_names=["images"],
         output_names=output_names,
         dynamic_axes=dynamic or None,
+        **({"dynamo": False} if check_version(torch.__version__, "2.5.0") else {}),  # TorchScript-based exporter
     )
 
     # Checks
@@ -221,16 +224,20 @@ def export_onnx(model, im, file, opset, dynamic, simplify, prefix=colorstr("ONNX
 @try_export
 def export_openvino(file, metadata, half, int8, data, prefix=colorstr("OpenVINO:")):
     # YOLOv5 OpenVINO export
-    check_requirements("openvino-dev>=2023.0")  # requires openvino-dev: https://pypi.org/project/openvino-dev/
-    import openvino.runtime as ov  # noqa
-    from openvino.tools import mo  # noqa
+    check_requirements("openvino>=2023.0")
+    import openvino as ov  # noqa
 
     LOGGER.info(f"\n{prefix} starting export with openvino {ov.__version__}...")
     f = str(file).replace(file.suffix, f"_{'int8_' if int8 else ''}openvino_model{os.sep}")
     f_onnx = file.with_suffix(".onnx")
     f_ov = str(Path(f) / file.with_suffix(".xml").name)
 
-    ov_model = mo.convert_model(f_onnx, model_name=file.stem, framework="onnx", compress_to_fp16=half)  # export
+    if hasattr(ov, "convert_model"):  # openvino>=2023.1
+        ov_model = ov.convert_model(f_onnx)  # export
+    else:  # openvino-dev model optimizer
+        from openvino.tools import mo  # noqa
+
+        ov_model = mo.convert_model(f_onnx, model_name=file.stem, framework="onnx", compress_to_fp16=half)
 
     if int8:
         check_requirements("nncf>=2.5.0")  # requires at least version 2.5.0 to use the post-training quantization
@@ -269,11 +276,44 @@ def export_openvino(file, metadata, half, int8, data, prefix=colorstr("OpenVINO:
         quantization_dataset = nncf.Dataset(ds, transform_fn)
         ov_model = nncf.quantize(ov_model, quantization_dataset, preset=nncf.QuantizationPreset.MIXED)
 
-    ov.serialize(ov_model, f_ov)  # save
+    if hasattr(ov, "save_model"):
+        ov.save_model(ov_model, f_ov, compress_to_fp16=half)  # save
+    else:
+        from openvino.runtime import serialize  # noqa
+
+        serialize(ov_model, f_ov)
     yaml_save(Path(f) / file.with_suffix(".yaml").name, metadata)  # add metadata.yaml
     return f, None
 
 
+def check_parity(model, im, file, dynamic=False, half=False, prefix=colorstr("Parity:")):
+    # Compare exported model outputs to PyTorch on random images, at the export shape and a second shape if dynamic.
+    # half: exported weights are FP16, i.e. TFLite fp16, tolerance as for FP16 inference
+    try:
+        device = next(model.parameters()).device  # cpu after --dynamic ONNX export
+        backend = DetectMultiBackend(file, device=device, fp16=im.dtype is torch.float16)
+        b, c, h, w = im.shape
+        gs = int(max(model.stride))
+        shapes = [(b, c, h, w)] + ([(b + 1, c, max(h // 2 // gs, 1) * gs, w)] if dynamic else [])
+        for shape in shapes:
+            x = torch.rand(shape, device=device, dtype=im.dtype)
+            y = model(x)
+            y = (y[0] if isinstance(y, (list, tuple)) else y).float()
+            if backend.saved_model or backend.pb or backend.tflite:  # TFDetect outputs (ny*nx, na), not (na, ny*nx)
+                m = model.model[-1]
+                ys = y.split([m.na * (shape[2] // int(s)) * (shape[3] // int(s)) for s in m.stride], 1)
+                y = torch.cat([t.unflatten(1, (m.na, -1)).transpose(1, 2).reshape(t.shape) for t in ys], 1)
+            ye = backend(x)
+            ye = torch.as_tensor(ye[0] if isinstance(ye, (list, tuple)) else ye, device=y.device).float()
+            d = (ye - y).abs().max().item()
+            tol = (1e-2 if half or im.dtype is torch.float16 else 1e-3) * max(y.abs().max().item(), 1)
+            ok = ye.shape == y.shape and d <= tol
+            s = f"{prefix} {file} {tuple(shape)} max abs diff {d:.3g} (tolerance {tol:.3g})"
+            LOGGER.info(f"{s} ✅") if ok else LOGGER.warning(f"WARNING ⚠️ {s} parity failure")
+    except Exception as e:
+        LOGGER.warning(f"WARNING ⚠️ {prefix} {file} parity check failure: {e}")
+
+
 @try_export
 def export_paddle(model, im, file, metadata, prefix=colorstr("PaddlePaddle:")):
     # YOLOv5 Paddle export
@@ -756,6 +796,7 @@ def run(
     topk_all=100,  # TF.js NMS: topk for all classes to keep
     iou_thres=0.45,  # TF.js NMS: IoU threshold
     conf_thres=0.25,  # TF.js NMS: confidence threshold
+    parity=True,  # compare TorchScript/ONNX/OpenVINO/TF outputs to PyTorch
 ):
     t = time.time()
     include = [x.lower() for x in include]  # to lowercase
@@ -770,7 +811,11 @@ def run(
     if half:
         assert device.type != "cpu" or coreml, "--half only compatible with GPU export, i.e. use --device 0"
         assert not dynamic, "--half not compatible with --dynamic, i.e. use either --half or --dynamic but not both"
-    model = attempt_load(weights, device=device, inplace=True, fuse=True)  # load FP32 model
+    model = attempt_load(weights, device=device, inplace=True, fuse=True)  # load FP32 model, SpatialIE deployed
+    if dynamic:
+        assert all(m.scale == 1 for m in model.modules() if isinstance(m, SpatialIE)), (
+            "--dynamic not compatible with SpatialIE scale<1, its reduced resolution is fixed at trace time"
+        )
 
     # Checks
     imgsz *= 2 if len(imgsz) == 1 else 1  # expand
@@ -843,6 +888,13 @@ def run(
     if paddle:  # PaddlePaddle
         f[10], _ = export_paddle(model, im, file, metadata)
 
+    # Parity
+    if parity:
+        for x in f[0], f[2], f[3], f[5], f[7]:  # TorchScript, ONNX, OpenVINO, TF SavedModel, TFLite (not INT8)
+            if x and not (x == f[7] and (int8 or edgetpu)):
+                # traced TorchScript and TF image sizes are static
+                check_parity(model, im, x, dynamic=dynamic and x in (f[2], f[3]), half=x == f[7])
+
     # Finish
     f = [str(x) for x in f if x]  # filter out '' and None
     if any(f):
@@ -892,6 +944,7 @@ def parse_opt(known=False):
     parser.add_argument("--topk-all", type=int, default=100, help="TF.js NMS: topk for all classes to keep")
     parser.add_argument("--iou-thres", type=float, default=0.45, help="TF.js NMS: IoU threshold")
     parser.add_argument("--conf-thres", type=float, default=0.25, help="TF.js NMS: confidence threshold")
+    parser.add_argument("--no-parity", action="store_false", dest="parity", help="skip PyTorch parity check")
     parser.add_argument(
         "--include",
         nargs="+",
@@ -1,14 +1,16 @@
-import cv2 as cv, math
+import cv2 as cv
 import cv2
-import numpy as np
-import random
 import os
 
+from utils.degradations import add_fog
+
 file = ''  # Input path to the image folder
+output = 'fog'  # Output path for the foggy images, or python -m utils.degradations.fog for whole directory trees
 
 
 
 def demo():
+    os.makedirs(output, exist_ok=True)
     for file_img in os.listdir(file):  # Folders to process
         print(file_img)
         img_path = os.path.join(file, file_img)
@@ -17,19 +19,13 @@ def demo():
         print(img_path)
 
 
-        img_f = img / 255.0 
         (row, col, chs) = img.shape
 
         A = 0.5  
         beta = 0.14  # This is the concentration of the fog. It's adjustable.
-        size = math.sqrt(max(row, col))  
         center = (row // 2, col // 2)  
-        for j in range(row):
-            for l in range(col):
-                d = -0.04 * math.sqrt((j - center[0]) ** 2 + (l - center[1]) ** 2) + size
-                td = math.exp(-beta * d)
-                img_f[j][l][:] = img_f[j][l][:] * td + A * (1 - td)
-        cv2.imwrite(file_img, img_f*255) 
+        img_f = add_fog(img, beta, A, center)  # vectorized, see utils/degradations/fog.py
+        cv2.imwrite(os.path.join(output, file_img), img_f) 
         cv2.imshow("src", img)
         cv2.imshow("dst", img_f) 
 
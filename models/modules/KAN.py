@@ -1,7 +1,11 @@
 import torch
+import torch.distributed as dist
 import torch.nn.functional as F
 import math
 
+from utils.general import LOGGER
+from utils.torch_utils import is_compiling, time_sync
+
 """
 1.内存效率提升：原始实现需要扩展所有中间变量来执行不同的激活函数，而此代码中将计算重新制定为使用不同的基函数激活输入，
   然后线性组合它们。这种重新制定可以显著降低内存成本，并将计算变得更加高效。
@@ -15,7 +19,44 @@ import math
 4.参数初始化的改变：为了解决在MNIST数据集上的性能问题，此代码修改了参数的初始化方式，使用kaiming初始化。
 """
 
+class ChunkedKANLinear(torch.autograd.Function):
+    """
+    KANLinear output base_activation(x) @ base_weight^T + b_splines(x) @ spline_weight^T over token chunks.
+
+    Only x and the weights are saved, activations and B-spline bases are recomputed chunk by chunk in backward, so no
+    (tokens, in_features, grid_size + spline_order) tensor outlives a chunk.
+    """
+
+    @staticmethod
+    def forward(ctx, x, base_weight, spline_weight, layer, chunk):
+        with torch.autocast(x.device.type, enabled=False):
+            out = layer._forward_chunked(x, base_weight, spline_weight, chunk)
+        ctx.save_for_backward(x, base_weight, spline_weight)
+        ctx.layer, ctx.chunk = layer, chunk
+        return out
+
+    @staticmethod
+    def backward(ctx, grad_out):
+        x, base_weight, spline_weight = ctx.saved_tensors
+        layer, chunk, need_x = ctx.layer, ctx.chunk, ctx.needs_input_grad[0]
+        w = spline_weight.view(spline_weight.size(0), -1)  # (out, in * coeff)
+        grad_x = torch.empty_like(x) if need_x else None
+        grad_base, grad_spline = torch.zeros_like(base_weight), torch.zeros_like(w)
+        with torch.autocast(x.device.type, enabled=False), torch.enable_grad():
+            for i in range(0, x.size(0), chunk):
+                s = slice(i, i + chunk)
+                xi, gi = x[s].detach().requires_grad_(need_x), grad_out[s].to(x.dtype)
+                act, bases = layer.base_activation(xi), layer.b_splines(xi)
+                grad_base += gi.T @ act.detach()
+                grad_spline += gi.T @ bases.detach().view(xi.size(0), -1)
+                if need_x:
+                    grad_x[s] = torch.autograd.grad((act, bases), xi, (gi @ base_weight, (gi @ w).view_as(bases)))[0]
+        return grad_x, grad_base, grad_spline.view_as(spline_weight), None, None
+
+
 class KANLinear(torch.nn.Module):
+    chunk = 1 << 16  # tokens per chunk, bounds the B-spline bases to (chunk, in_features, grid_size + spline_order)
+
     def __init__(
         self,
         in_features,
@@ -62,9 +103,31 @@ class KANLinear(torch.nn.Module):
         self.enable_standalone_scale_spline = enable_standalone_scale_spline
         self.base_activation = base_activation()
         self.grid_eps = grid_eps
+        self._check_grid()  # sets uniform_grid, True for the initial grid
+        self._tracking = {}  # streaming grid adaptation, see track_grid()
+        for k in 'lut', 'lut_x0', 'lut_scale':  # edge function lookup table, see freeze_to_lut()
+            self.register_buffer(k, None, persistent=False)
 
         self.reset_parameters()  # 重置参数
 
+    def __setstate__(self, state):
+        # Checkpoints pickled before the uniform grid flag and lookup table existed
+        super().__setstate__(state)
+        self.__dict__.pop('_grid_cache', None)  # replaced by uniform_grid
+        self._check_grid()  # pickled flags may be stale, i.e. EMA models of older checkpoints
+        self.__dict__.setdefault('_tracking', {})
+        for k in 'lut', 'lut_x0', 'lut_scale':
+            if k not in self._buffers:
+                self.register_buffer(k, None, persistent=False)
+
+    def __getstate__(self):
+        # Checkpoints and deepcopies leave out the track_grid() reservoir, which restarts empty
+        state = self.__dict__.copy()
+        if 'reservoir' in self._tracking:
+            state['_tracking'] = {k: v for k, v in self._tracking.items() if k != 'reservoir'}
+            state['_tracking']['seen'] = 0
+        return state
+
     def reset_parameters(self):
         torch.nn.init.kaiming_uniform_(self.base_weight, a=math.sqrt(5) * self.scale_base)# 使用 Kaiming 均匀初始化基础权重
         with torch.no_grad():
@@ -91,6 +154,82 @@ class KANLinear(torch.nn.Module):
         """
         Compute the B-spline bases for the given input tensor.
 
+        Uniform grids (the initial grid, and any grid until update_grid() adapts it) use the closed-form cardinal
+        B-spline in _b_splines_uniform(), other grids the Cox-de Boor recursion in _b_splines_recursive(). The choice
+        follows the uniform_grid flag, re-validated whenever the grid buffer has been written in place since the last
+        check, except while tracing or compiling, see _uniform().
+
+        Args:
+            x (torch.Tensor): Input tensor of shape (batch_size, in_features).
+
+        Returns:
+            torch.Tensor: B-spline bases tensor of shape (batch_size, in_features, grid_size + spline_order).
+        """
+        assert x.dim() == 2 and x.size(1) == self.in_features
+        bases = self._b_splines_uniform(x) if self._uniform() else self._b_splines_recursive(x)
+        assert bases.size() == (
+            x.size(0),
+            self.in_features,
+            self.grid_size + self.spline_order,
+        )
+        return bases
+
+    @torch.no_grad()
+    def _check_grid(self):
+        # Set the plain bool uniform_grid, True if every grid row has equally spaced knots, for the current grid version
+        g = self.grid
+        h = g.diff(dim=1)  # (in_features, grid_size + 2 * spline_order)
+        step = h.mean(1, keepdim=True)
+        self.uniform_grid = bool(((h - step).abs() <= 1e-4 * step.abs()).all())
+        self._grid_version = None if g.is_inference() else g._version  # inference tensors have no version counter
+
+    def _uniform(self):
+        # uniform_grid, re-checked if the grid buffer was written in place (EMA, copy_, load) or replaced since the
+        # last check. Traced and compiled graphs branch on the plain flag only, no graph breaks under
+        # torch.compile(fullgraph=True)
+        g = self.grid
+        if not (torch.jit.is_tracing() or is_compiling() or g.is_inference()) and g._version != self._grid_version:
+            self._check_grid()
+        return self.uniform_grid
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        super()._load_from_state_dict(*args, **kwargs)
+        self._check_grid()
+
+    def _b_splines_uniform(self, x: torch.Tensor):
+        """
+        Closed-form B-spline bases on a uniform grid.
+
+        With knot spacing h, x lies in knot span i = floor((x - grid[0]) / h) at fraction f, and only the
+        spline_order + 1 bases i - spline_order ... i are nonzero. Their values are the cardinal B-spline polynomials
+        in f (cubic for spline_order=3), so the bases cost a few (batch_size, in_features) ops and one scatter instead
+        of spline_order passes over (batch_size, in_features, grid_size + spline_order) temporaries. Inputs outside
+        the grid get zero bases, as in the recursion.
+        """
+        k, n = self.spline_order, self.grid_size + self.spline_order
+        g = self.grid.to(x.dtype)
+        t0, h = g[:, 0], (g[:, -1] - g[:, 0]) / (n + k)  # (in_features,)
+        u = (x - t0) / h  # position in knot spans
+        i = u.floor()
+        f = u - i  # (batch_size, in_features) in [0, 1)
+        if k == 3:
+            f2, f3 = f * f, f * f * f
+            w = [(1 - f) ** 3 / 6, (3 * f3 - 6 * f2 + 4) / 6, (-3 * f3 + 3 * f2 + 3 * f + 1) / 6, f3 / 6]
+        else:  # cardinal B-spline recursion M_d(t) = (t M_d-1(t) + (d + 1 - t) M_d-1(t - 1)) / d on t = f + s only
+            b = [torch.ones_like(f)]  # b[s] = M_d(f + s), s = 0 ... d
+            for d in range(1, k + 1):
+                b = [((f + s) * b[s] if s < d else 0) + ((d + 1 - s - f) * b[s - 1] if s else 0) for s in range(d + 1)]
+                b = [y / d for y in b]
+            w = b[::-1]  # basis i - k + r is M_k(f + k - r)
+        valid = (u >= 0) & (u < n + k)  # x in [grid[0], grid[-1]), False for NaN
+        w = torch.where(valid.unsqueeze(-1), torch.stack(w, -1), 0)  # (batch_size, in_features, k + 1)
+        idx = torch.where(valid, i, 0).long().unsqueeze(-1) + torch.arange(k + 1, device=x.device)  # basis index + k
+        return x.new_zeros(*x.shape, n + 2 * k).scatter(2, idx, w)[..., k : k + n]
+
+    def _b_splines_recursive(self, x: torch.Tensor):
+        """
+        Compute the B-spline bases for the given input tensor by the Cox-de Boor recursion, on any grid.
+
         Args:
             x (torch.Tensor): Input tensor of shape (batch_size, in_features).
 
@@ -106,8 +245,6 @@ class KANLinear(torch.nn.Module):
         返回:
         torch.Tensor: B-样条基函数张量，形状为 (batch_size, in_features, grid_size + spline_order)。
         """
-        assert x.dim() == 2 and x.size(1) == self.in_features
-
         grid: torch.Tensor = ( # 形状为 (in_features, grid_size + 2 * spline_order + 1)
             self.grid
         )  # (in_features, grid_size + 2 * spline_order + 1)
@@ -123,12 +260,6 @@ class KANLinear(torch.nn.Module):
                 / (grid[:, k + 1 :] - grid[:, 1:(-k)])
                 * bases[:, :, 1:]
             )
-
-        assert bases.size() == (
-            x.size(0),
-            self.in_features,
-            self.grid_size + self.spline_order,
-        )
         return bases.contiguous()
 
     def curve2coeff(self, x: torch.Tensor, y: torch.Tensor):
@@ -197,13 +328,104 @@ class KANLinear(torch.nn.Module):
         torch.Tensor: 输出张量，形状为 (batch_size, out_features)。
         """
         assert x.dim() == 2 and x.size(1) == self.in_features
+        if self._tracking and self.training and torch.is_grad_enabled():
+            self._track(x)
+        if self.lut is not None and not self.training:
+            return self._forward_chunked(x, chunk=0 if torch.jit.is_tracing() else self.chunk)
+
+        tracing = torch.jit.is_tracing()
+        if torch.is_grad_enabled() and (x.requires_grad or self.base_weight.requires_grad) and not tracing:
+            # recompute the B-spline bases in backward
+            return ChunkedKANLinear.apply(x, self.base_weight, self.scaled_spline_weight, self, self.chunk)
+        return self._forward_chunked(x, self.base_weight, self.scaled_spline_weight, 0 if tracing else self.chunk)
+
+    def _forward_chunked(self, x, base_weight=None, spline_weight=None, chunk=0):
+        # forward() over chunks of `chunk` tokens (0 for a single pass), by the lookup table if base_weight is None
+        def run(x):
+            if base_weight is None:
+                return self._forward_lut(x)
+            base_output = F.linear(self.base_activation(x), base_weight) # 计算基础线性层的输出
+            spline_output = F.linear( # 计算分段多项式线性层的输出
+                self.b_splines(x).view(x.size(0), -1),
+                spline_weight.view(self.out_features, -1),
+            )
+            return base_output + spline_output  # 返回基础线性层输出和分段多项式线性层输出的和
+
+        n = x.size(0)
+        if not chunk or n <= chunk:
+            return run(x)
+        y = run(x[:chunk])
+        out = y.new_empty(n, self.out_features)
+        out[:chunk] = y
+        for i in range(chunk, n, chunk):
+            out[i:i + chunk] = run(x[i:i + chunk])
+        return out
+
+    def edge_functions(self, x: torch.Tensor):
+        """
+        Evaluate every edge function base_activation(x) * base_weight + spline(x) * scaled_spline_weight separately.
+
+        Args:
+            x (torch.Tensor): Input tensor of shape (batch_size, in_features).
 
-        base_output = F.linear(self.base_activation(x), self.base_weight) # 计算基础线性层的输出
-        spline_output = F.linear( # 计算分段多项式线性层的输出
-            self.b_splines(x).view(x.size(0), -1),
-            self.scaled_spline_weight.view(self.out_features, -1),
+        Returns:
+            torch.Tensor: Edge outputs of shape (batch_size, in_features, out_features), summing over in_features gives
+            forward(x).
+        """
+        return self.base_activation(x).unsqueeze(-1) * self.base_weight.T + torch.einsum(
+            'nic,oic->nio', self.b_splines(x), self.scaled_spline_weight
         )
-        return base_output + spline_output  # 返回基础线性层输出和分段多项式线性层输出的和
+
+    @torch.no_grad()
+    def freeze_to_lut(self, resolution=1024, oversample=8):
+        """
+        Sample each edge function at `resolution` points over the knot range of its input, grid[:, 0] to grid[:, -1],
+        for eval-mode forward() by linear interpolation and a gather-and-sum (F.embedding_bag), without B-spline bases.
+        Outside the knot range the splines are zero and only the base term is added back exactly. Re-freeze after
+        changing weights or the grid, update_grid() drops the table.
+
+        Returns:
+            float: Estimated maximum approximation error of the layer output, the largest sum over inputs of the
+            per-edge interpolation error, each measured at `oversample` points per table interval. A dense-sample
+            estimate, not a bound.
+        """
+        assert resolution > 1 and oversample > 1, 'freeze_to_lut() resolution and oversample must be at least 2'
+        r = resolution
+        x0, x1 = self.grid[:, 0], self.grid[:, -1]  # (in_features,)
+        scale = (r - 1) / (x1 - x0)  # samples per unit input
+        t = torch.arange(r, device=x0.device, dtype=x0.dtype).unsqueeze(1)
+        table = self.edge_functions(x0 + t / scale)  # (r, in, out)
+
+        # Interpolation error at oversample - 1 interior points of every interval, intervals in chunks
+        f = torch.arange(1, oversample, device=x0.device, dtype=x0.dtype) / oversample  # (o - 1,) fractions
+        error = table.new_zeros(self.in_features, self.out_features)
+        n = max(4096 // oversample, 1)  # intervals per chunk
+        for i in range(0, r - 1, n):
+            a, b = table[i:i + n][:, None], table[i + 1:i + n + 1][:, None]  # (n, 1, in, out) interval ends
+            u = (t[i:i + len(b)] + f).reshape(-1, 1)  # (n * (o - 1), 1) positions in samples
+            exact = self.edge_functions(x0 + u / scale).view(len(b), len(f), self.in_features, self.out_features)
+            lerp = a[:len(b)] + f.view(1, -1, 1, 1) * (b - a[:len(b)])
+            error = torch.maximum(error, (exact - lerp).abs().amax((0, 1)))
+        error = error.sum(0).max().item()  # (in, out) edges, sum over in
+        self.lut = table.transpose(0, 1).reshape(-1, self.out_features).contiguous()  # (in * r, out)
+        self.lut_x0, self.lut_scale = x0.clone(), scale
+        return error
+
+    def _forward_lut(self, x: torch.Tensor):
+        # Eval-mode forward() by the lookup table of freeze_to_lut()
+        r = self.lut.size(0) // self.in_features
+        u = (x - self.lut_x0) * self.lut_scale  # (batch_size, in_features) position in samples
+        uc = u.clamp(0, r - 1)
+        i = uc.floor().clamp(max=r - 2)
+        f = (uc - i).to(self.lut.dtype)
+        i = i.long() + torch.arange(0, self.in_features * r, r, device=x.device)  # row in the flattened table
+        y = F.embedding_bag(torch.cat((i, i + 1), 1), self.lut, per_sample_weights=torch.cat((1 - f, f), 1), mode='sum')
+        outside = u != uc  # beyond the knot range the splines are zero, only the base term keeps changing
+        if outside.any():
+            xc = self.lut_x0 + uc / self.lut_scale
+            dx = torch.where(outside, self.base_activation(x) - self.base_activation(xc), 0)
+            y = y + F.linear(dx, self.base_weight)
+        return y.to(x.dtype)
 
     @torch.no_grad()
     # 更新网格。
@@ -215,6 +437,19 @@ class KANLinear(torch.nn.Module):
         assert x.dim() == 2 and x.size(1) == self.in_features
         batch = x.size(0)
 
+        # sort each channel individually to collect data distribution
+        x_sorted = torch.sort(x, dim=0)[0] # 对每个通道单独排序以收集数据分布
+        grid_adaptive = x_sorted[
+            torch.linspace(
+                0, batch - 1, self.grid_size + 1, dtype=torch.int64, device=x.device
+            )
+        ]
+        self._refit_grid(grid_adaptive, x, margin)
+
+    @torch.no_grad()
+    def _refit_grid(self, grid_adaptive, x, margin=0.01):
+        # Set the grid from per-feature quantiles grid_adaptive (grid_size + 1, in_features) at 0, 1/grid_size ... 1,
+        # and refit the spline coefficients to reproduce the current spline outputs on inputs x (batch, in_features)
         splines = self.b_splines(x)  # (batch, in, coeff)  # 计算 B-样条基函数
         splines = splines.permute(1, 0, 2)  # (in, batch, coeff)  # 调整维度顺序为 (in, batch, coeff)
         orig_coeff = self.scaled_spline_weight  # (out, in, coeff)
@@ -224,21 +459,13 @@ class KANLinear(torch.nn.Module):
             1, 0, 2
         )  # (batch, in, out)
 
-        # sort each channel individually to collect data distribution
-        x_sorted = torch.sort(x, dim=0)[0] # 对每个通道单独排序以收集数据分布
-        grid_adaptive = x_sorted[
-            torch.linspace(
-                0, batch - 1, self.grid_size + 1, dtype=torch.int64, device=x.device
-            )
-        ]
-
-        uniform_step = (x_sorted[-1] - x_sorted[0] + 2 * margin) / self.grid_size
+        uniform_step = (grid_adaptive[-1] - grid_adaptive[0] + 2 * margin) / self.grid_size
         grid_uniform = (
             torch.arange(
                 self.grid_size + 1, dtype=torch.float32, device=x.device
             ).unsqueeze(1)
             * uniform_step
-            + x_sorted[0]
+            + grid_adaptive[0]
             - margin
         )
 
@@ -257,7 +484,58 @@ class KANLinear(torch.nn.Module):
         )
 
         self.grid.copy_(grid.T)   # 更新网格和分段多项式权重
+        self._check_grid()
         self.spline_weight.data.copy_(self.curve2coeff(x, unreduced_spline_output))
+        self.lut = None  # edge functions changed, freeze_to_lut() again
+
+    def track_grid(self, interval=200, momentum=0.05, sample=4096, reservoir=16384, margin=0.01):
+        """
+        Adapt the grid incrementally during training, instead of update_grid() sorting and refitting on whole batches.
+
+        Each training forward sorts `sample` random input tokens and folds their per-feature quantiles into running
+        quantiles with `momentum`. The tokens also enter a uniform reservoir sample of up to `reservoir` inputs seen so
+        far. Every `interval` forwards the grid is rebuilt from the running quantiles and the spline coefficients are
+        refit on the reservoir, as update_grid() does on a batch. Cost per forward is independent of the token count.
+        Under DDP the running quantiles are averaged over ranks at every refit, rank 0 refits on its reservoir and
+        broadcasts the grid and spline weights, so the replicas stay identical. The reservoir is not saved in
+        checkpoints. interval=0 stops tracking.
+        """
+        self._tracking = {'interval': interval, 'momentum': momentum, 'sample': sample, 'size': reservoir,
+                          'margin': margin, 'steps': 0, 'seen': 0} if interval else {}
+        return self
+
+    @torch.no_grad()
+    def _track(self, x: torch.Tensor):
+        # track_grid() update for training inputs x (batch, in_features)
+        t = self._tracking
+        if t.get('paused'):  # activation checkpointing recompute, see frozen_bn_stats()
+            return
+        x = x.detach()[torch.randperm(x.size(0), device=x.device)[:t['sample']]].float()
+        n = x.size(0)
+        q = torch.sort(x, dim=0)[0][torch.linspace(0, n - 1, self.grid_size + 1, device=x.device).long()]
+        t['q'] = q if 'q' not in t else t['q'].to(x.device).lerp_(q, t['momentum'])
+
+        # Reservoir sampling (Algorithm R), token i of the stream replaces a random slot with probability size / (i + 1)
+        size, seen = t['size'], t['seen']
+        r = t['reservoir'] = t['reservoir'].to(x.device) if 'reservoir' in t else x.new_empty(size, self.in_features)
+        i = torch.arange(seen, seen + n, device=x.device)
+        j = torch.where(i < size, i, (torch.rand(n, device=x.device) * (i + 1)).long())
+        keep = j < size
+        r[j[keep]] = x[keep]
+        t['seen'], t['steps'] = seen + n, t['steps'] + 1
+
+        if t['steps'] % t['interval'] == 0:  # every rank gets here on the same step
+            ddp = dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+            if ddp:  # global running quantiles
+                dist.all_reduce(t['q'])
+                t['q'] /= dist.get_world_size()
+            if not ddp or dist.get_rank() == 0:
+                self._refit_grid(t['q'], r[:min(t['seen'], size)].to(self.grid.dtype), t['margin'])
+            if ddp:  # DDP only all-reduces gradients, sync the refit weights from rank 0
+                dist.broadcast(self.grid, 0)
+                dist.broadcast(self.spline_weight.data, 0)
+                self._check_grid()
+                self.lut = None
 
     def regularization_loss(self, regularize_activation=1.0, regularize_entropy=1.0):
         # 计算正则化损失，用于约束模型的参数，防止过拟合
@@ -363,6 +641,33 @@ class KAN(torch.nn.Module): # 封装了一个KAN神经网络模型，可以用
             x = layer(x)
         return x
 
+    @torch.no_grad()
+    def freeze_to_lut(self, resolution=1024, oversample=8, verbose=True):
+        """
+        Replace B-spline evaluation in every layer by edge function lookup tables for inference, see
+        KANLinear.freeze_to_lut(). Applies to eval mode, for example on a loaded enhancer:
+
+            for m in model.modules():
+                if isinstance(m, KAN):
+                    m.freeze_to_lut(1024)
+
+        Returns:
+            list: Estimated maximum approximation error of each layer output, see KANLinear.freeze_to_lut().
+        """
+        errors = [layer.freeze_to_lut(resolution, oversample) for layer in self.layers]
+        if verbose:
+            e = ', '.join(f'{e:.2e}' for e in errors)
+            LOGGER.info(f'KAN lookup tables: {resolution} samples per edge, estimated max output error {e}')
+        return errors
+
+    def track_grid(self, interval=200, **kwargs):
+        """
+        Streaming grid adaptation of every layer during training, see KANLinear.track_grid(). interval=0 stops it.
+        """
+        for layer in self.layers:
+            layer.track_grid(interval, **kwargs)
+        return self
+
     def regularization_loss(self, regularize_activation=1.0, regularize_entropy=1.0):#计算正则化损失的方法，用于约束模型的参数，防止过拟合。
         """
         计算正则化损失。
@@ -378,3 +683,144 @@ class KAN(torch.nn.Module): # 封装了一个KAN神经网络模型，可以用
             layer.regularization_loss(regularize_activation, regularize_entropy)
             for layer in self.layers
         )
+
+
+class KANPolyLinear(torch.nn.Module):
+    """
+    Piecewise polynomial replacement for a trained KANLinear, see distill_kan_linear().
+
+    Each edge keeps its exact base term base_activation(x) * base_weight. Its spline is fitted by least squares to a
+    degree `degree` polynomial on `segments` equal pieces of the knot range, in truncated-power form, and held at its
+    boundary value (zero) outside the range like the B-splines. Powers are built by repeated multiplication, so the
+    layer is elementwise ops and one matmul, with no grid comparisons or basis recursion. With one segment per knot
+    interval of a uniform grid and degree = spline_order the fit is exact.
+    """
+
+    def __init__(self, layer, segments=4, degree=3, samples=64):
+        super().__init__()
+        self.in_features, self.out_features = layer.in_features, layer.out_features
+        self.segments, self.degree = segments, degree
+        self.base_activation = layer.base_activation
+        x0, x1 = layer.grid[:, 0].double(), layer.grid[:, -1].double()
+        self.register_buffer('x0', x0.float())
+        self.register_buffer('scale', (segments / (x1 - x0)).float())  # knot range to [0, segments]
+        self.register_buffer('knots', torch.arange(1, segments, dtype=torch.float32, device=x0.device))
+
+        # Least squares fit in float64, the features of t are shared by all edges
+        t = torch.linspace(0, segments, samples * segments + 1, dtype=torch.float64, device=x0.device)
+        with torch.no_grad():
+            x = (x0 + t[:, None] / (segments / (x1 - x0))).to(layer.grid.dtype)  # (r, in)
+            spline = torch.einsum('nic,oic->nio', layer.b_splines(x), layer.scaled_spline_weight).double()
+            knots = self.knots.double()
+            a = torch.cat((torch.ones_like(t)[:, None], self._poly(t[:, None], knots)[:, 0]), 1)  # (r, 1 + features)
+            coef = torch.linalg.lstsq(a, spline.flatten(1)).solution.view(-1, self.in_features, self.out_features)
+            weight = torch.cat((layer.base_weight.T[None].double(), coef[1:]))  # (1 + features, in, out)
+        self.weight = torch.nn.Parameter(weight.permute(2, 1, 0).reshape(self.out_features, -1).float())
+        self.bias = torch.nn.Parameter(coef[0].sum(0).float())  # constant terms of all edges
+
+    def _poly(self, t, knots):
+        # (n, in) normalized inputs to (n, in, degree + segments - 1) features: t^1..t^degree and relu(t - knot)^degree
+        t = t.unsqueeze(-1)
+        r = (t - knots).relu()
+        p, rp = [t], r
+        for _ in range(self.degree - 1):
+            p.append(p[-1] * t)
+            rp = rp * r
+        return torch.cat((*p, rp), -1)
+
+    def forward(self, x: torch.Tensor):
+        assert x.dim() == 2 and x.size(1) == self.in_features
+        t = ((x - self.x0) * self.scale).clamp(0, self.segments)
+        f = torch.cat((self.base_activation(x).unsqueeze(-1), self._poly(t, self.knots)), -1)  # (n, in, 1 + features)
+        return F.linear(f.view(x.size(0), -1), self.weight, self.bias)
+
+
+def _fit_mlp(layer, x, y, hidden, steps=2000, batch=4096, lr=1e-3):
+    # Train a Linear-SiLU-Linear stack on inputs x (n, in_features) to outputs y (n, out_features) of KANLinear `layer`
+    m = torch.nn.Sequential(
+        torch.nn.Linear(layer.in_features, hidden), torch.nn.SiLU(), torch.nn.Linear(hidden, layer.out_features)
+    ).to(x.device)
+    optimizer = torch.optim.Adam(m.parameters(), lr)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, steps)
+    with torch.enable_grad():
+        for _ in range(steps):
+            i = torch.randint(len(x), (min(batch, len(x)),), device=x.device)
+            loss = F.mse_loss(m(x[i]), y[i])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            scheduler.step()
+    return m.eval()
+
+
+@torch.no_grad()
+def distill_kan_linear(layer, x, method='poly', max_error=1e-2, steps=2000):
+    """
+    Fit the smallest deployable replacement for trained KANLinear `layer` whose maximum absolute output error on
+    held-out inputs stays within `max_error`. Candidates, smallest first:
+        'poly': KANPolyLinear with 1, 2, 4, 8 segments, then one segment per knot interval (exact on uniform grids)
+        'mlp': Linear-SiLU-Linear with in_features x 1, 2, 4 hidden units, trained for `steps` Adam steps
+
+    Args:
+        layer (KANLinear): Trained layer.
+        x (torch.Tensor): Representative inputs of shape (tokens, in_features), for example recorded on calibration
+            images. 10% are held out to measure the error, the rest train 'mlp' candidates.
+
+    Returns:
+        (tuple): Replacement module, or `layer` itself if no candidate meets the budget, its max error and a
+            description.
+    """
+    assert method in ('poly', 'mlp'), f"unknown KAN distillation method '{method}'"
+    x = x[torch.randperm(len(x), device=x.device)].to(layer.grid.dtype)
+    n = max(len(x) // 10, 1)
+    exact = lambda x: layer._forward_chunked(x, layer.base_weight, layer.scaled_spline_weight, layer.chunk)
+    test, y_test = x[:n], exact(x[:n])
+    if method == 'poly':
+        sizes = sorted({s for s in (1, 2, 4, 8) if s < layer.grid.size(1) - 1} | {layer.grid.size(1) - 1})
+        candidates = ((f'poly {s} segments', lambda s=s: KANPolyLinear(layer, s, layer.spline_order)) for s in sizes)
+    else:
+        train, y_train = x[n:], exact(x[n:])
+        candidates = ((f'mlp {h} hidden', lambda h=h: _fit_mlp(layer, train, y_train, h, steps))
+                      for h in (layer.in_features * k for k in (1, 2, 4)))
+    best = None
+    for desc, fit in candidates:
+        m = fit()
+        error = (m(test) - y_test).abs().max().item()
+        if best is None or error < best[1]:
+            best = m, error, desc
+        if error <= max_error:
+            return best
+    return layer, best[1], f'kept KANLinear, best {best[2]}'
+
+
+@torch.no_grad()
+def profile_b_splines(in_features=64, tokens=(4096, 65536, 262144), n=10, device=None):
+    """
+    Micro-benchmark KANLinear.b_splines(), closed-form uniform grid vs Cox-de Boor recursion, on random inputs in the
+    grid range. Tokens are B*H*W for a KANsformer. Returns a list of dicts with the median times (ms) and the max abs
+    difference of the bases.
+
+    Usage:
+        $ python -c "from models.modules.KAN import profile_b_splines; profile_b_splines()"
+    """
+    device = torch.device(device or ('cuda:0' if torch.cuda.is_available() else 'cpu'))
+    m = KANLinear(in_features, in_features).to(device)
+
+    def median_ms(fn, x):
+        fn(x)  # warmup
+        t = []
+        for _ in range(n):
+            t0 = time_sync()
+            fn(x)
+            t.append((time_sync() - t0) * 1e3)
+        return sorted(t)[n // 2]
+
+    results = []
+    LOGGER.info(f"{'tokens':>10}{'closed-form (ms)':>18}{'recursion (ms)':>16}{'speedup':>10}{'max diff':>12}")
+    for nt in tokens:
+        x = torch.rand(nt, in_features, device=device) * 2.2 - 1.1  # includes inputs outside the [-1, 1] grid range
+        tu, tr = median_ms(m._b_splines_uniform, x), median_ms(m._b_splines_recursive, x)
+        diff = (m._b_splines_uniform(x) - m._b_splines_recursive(x)).abs().max().item()
+        results.append({'tokens': nt, 'uniform_ms': tu, 'recursive_ms': tr, 'max_diff': diff})
+        LOGGER.info(f'{nt:>10}{tu:>18.3f}{tr:>16.3f}{tr / tu:>9.2f}x{diff:>12.2e}')
+    return results
@@ -1,15 +1,25 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+import contextlib
+import math
 import numbers
+from concurrent.futures import ThreadPoolExecutor
 from einops import rearrange
-from einops.layers.torch import Rearrange
+import csv
+import json
+import weakref
+from torch.utils.checkpoint import checkpoint
 import sys
 sys.path.append(r"yolov5-upload")
 from models.modules.KAN import *
+from utils.general import LOGGER, check_version
+from utils.torch_utils import fuse_conv_and_bn, is_compiling, time_sync
 
 __all__ = ['SpatialIE']
 
+TORCH_2_1 = check_version(torch.__version__, '2.1.0')  # activation checkpointing context_fn, dispatch mode profiling
+
 class RFAConv(nn.Module):  # 基于Group Conv实现的RFAConv
     def __init__(self, in_channel, out_channel, kernel_size=3, stride=1):
         super().__init__()
@@ -33,11 +43,84 @@ class RFAConv(nn.Module):  # 基于Group Conv实现的RFAConv
         weighted = weight.view(b, c, self.kernel_size ** 2, h, w).softmax(2)  # b c*kernel**2,h,w ->  b c k**2 h w
         feature = self.generate_feature(x).view(b, c, self.kernel_size ** 2, h, w)  # b c*kernel**2,h,w ->  b c k**2 h w   获得感受野空间特征
         weighted_data = feature * weighted
-        conv_data = rearrange(weighted_data, 'b c (n1 n2) h w -> b c (h n1) (w n2)', n1=self.kernel_size,
-                              # b c k**2 h w ->  b c h*k w*k
-                           n2=self.kernel_size)
+        k = self.kernel_size
+        conv_data = weighted_data.view(b, c, k, k, h, w).permute(0, 1, 4, 2, 5, 3).reshape(b, c, h * k, w * k)
+        # b c k**2 h w ->  b c h*k w*k, i.e. rearrange('b c (n1 n2) h w -> b c (h n1) (w n2)')
         return self.conv(conv_data)
 
+    def fuse(self):
+        # Fold the BatchNorm2d() of generate_feature and conv into the preceding Conv2d() for inference
+        self.generate_feature = nn.Sequential(fuse_conv_and_bn(*self.generate_feature[:2]), self.generate_feature[2])
+        self.conv = nn.Sequential(fuse_conv_and_bn(*self.conv[:2]), self.conv[2])
+
+@contextlib.contextmanager
+def frozen_bn_stats(m):
+    # Keep BatchNorm running statistics and KAN grid tracking unchanged while m is recomputed by activation
+    # checkpointing
+    bns = [x for x in m.modules() if isinstance(x, nn.modules.batchnorm._BatchNorm) and x.track_running_stats]
+    kans = [x for x in m.modules() if isinstance(x, KANLinear) and x._tracking]
+    saved = [(x.momentum, x.num_batches_tracked.clone()) for x in bns]
+    for x in bns:
+        x.momentum = 0.0
+    for x in kans:
+        x._tracking['paused'] = True
+    try:
+        yield
+    finally:
+        for x, (momentum, n) in zip(bns, saved):
+            x.momentum = momentum
+            x.num_batches_tracked.copy_(n)
+        for x in kans:
+            x._tracking['paused'] = False
+
+
+def maybe_checkpoint(m, *args):
+    # Call m(*args), recomputing its activations in backward if activation checkpointing is enabled on m
+    if getattr(m, 'checkpoint', False) and m.training and torch.is_grad_enabled():
+        return checkpoint(m, *args, use_reentrant=False,
+                          context_fn=lambda: (contextlib.nullcontext(), frozen_bn_stats(m)))
+    return m(*args)
+
+
+def PeakMemory():
+    # Dispatch mode tracking live and peak bytes of tensor storages created by dispatched ops, for devices without
+    # allocator stats. Built on first use from private torch>=2.1 APIs
+    assert TORCH_2_1, f'SpatialIE memory profiling requires torch>=2.1, not {torch.__version__}'
+    from torch.utils._python_dispatch import TorchDispatchMode
+    from torch.utils._pytree import tree_leaves
+
+    class PeakMemory(TorchDispatchMode):
+        def __init__(self):
+            super().__init__()
+            self.live, self.peak, self.storages = 0, 0, set()
+
+        def _free(self, key, n):
+            self.live -= n
+            self.storages.discard(key)
+
+        def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+            out = func(*args, **(kwargs or {}))
+            for t in tree_leaves(out):
+                if isinstance(t, torch.Tensor):
+                    st = t.untyped_storage()
+                    key, n = st.data_ptr(), st.nbytes()
+                    if key and key not in self.storages:
+                        self.storages.add(key)
+                        self.live += n
+                        self.peak = max(self.peak, self.live)
+                        weakref.finalize(st, self._free, key, n)
+            return out
+
+    return PeakMemory()
+
+
+def memory_format(x):
+    # Memory format of a 4D tensor, torch.channels_last for NHWC-strided tensors
+    if x.is_contiguous(memory_format=torch.channels_last) and not x.is_contiguous():
+        return torch.channels_last
+    return torch.contiguous_format
+
+
 class OverlapPatchEmbed(nn.Module):
     def __init__(self, in_c=3, embed_dim=48, bias=False):
         super(OverlapPatchEmbed, self).__init__()
@@ -58,22 +141,17 @@ class KANsformer(nn.Module):
         self.kan = KAN([dim,64,dim])
 
     def forward(self, x):
+        # Layout preserving: the bhwc permutes are free views for torch.channels_last inputs
         b, c, h, w = x.shape # bchw
-        x1 = x.permute(0, 2, 3, 1).contiguous() #bhwc
-        x1 = x1.view(b, -1, c) #b(hw)c
-        x1 = self.norm1(x1) #b(hw)c
-        x1 = x1.view(b, h, w, c) #bhwc
-        x1 = x1.permute(0, 3, 1, 2).contiguous() # bchw
-        x = x + self.attn(x1) # bchw
-        b2, c2, h2, w2 = x.shape # bchw
-        x2 = x.permute(0, 2, 3, 1).contiguous() #bhwc
-        x2 = x2.view(b2, -1, c2) #b(hw)c
-        x2 = self.norm2(x2) #b(hw)c
-        x2 = x2.view(b2, h2, w2, c2) #b(hw)c
-        x2 = x2.view(-1,c2)
-        x2 = self.kan(x2)
-        x2 = x2.view(b2, h2, w2, c2)
-        x2 = x2.permute(0, 3, 1, 2).contiguous()
+        fmt = memory_format(x)
+        x1 = self.norm1(x.permute(0, 2, 3, 1)) #bhwc
+        x1 = x1.permute(0, 3, 1, 2).contiguous(memory_format=fmt) # bchw
+        x = x + maybe_checkpoint(self.attn, x1) # bchw
+        x2 = self.norm2(x.permute(0, 2, 3, 1)) #bhwc
+        x2 = x2.reshape(-1, c) #(bhw)c
+        x2 = maybe_checkpoint(self.kan, x2)
+        x2 = x2.view(b, h, w, c)
+        x2 = x2.permute(0, 3, 1, 2).contiguous(memory_format=fmt)
         x2 = x + x2
 
         return x2
@@ -115,19 +193,13 @@ class TransformerBlockBackbone(nn.Module):
         self.mlp = Mlp(in_features=dim, hidden_features=mlp_hidden_dim, act_layer=act_layer, drop=drop_ratio)
 
     def forward(self, x):
-        b, c, h, w = x.shape # bchw
-        x1 = x.permute(0, 2, 3, 1).contiguous() #bhwc
-        x1 = x1.view(b, -1, c) #b(hw)c
-        x1 = self.norm1(x1) #b(hw)c
-        x1 = x1.view(b, h, w, c) #bhwc
-        x1 = x1.permute(0, 3, 1, 2).contiguous() # bchw
-        x = x + self.attn(x1) # bchw
-        b2, c2, h2, w2 = x.shape # bchw
-        x2 = x.permute(0, 2, 3, 1).contiguous() #bhwc
-        x2 = x2.view(b2, -1, c2) #b(hw)c
-        x2 = self.mlp(self.norm2(x2)) #b(hw)c
-        x2 = x2.view(b2, h2, w2, c2)
-        x2 = x2.permute(0, 3, 1, 2).contiguous()
+        # Layout preserving: the bhwc permutes are free views for torch.channels_last inputs
+        fmt = memory_format(x)
+        x1 = self.norm1(x.permute(0, 2, 3, 1)) #bhwc
+        x1 = x1.permute(0, 3, 1, 2).contiguous(memory_format=fmt) # bchw
+        x = x + maybe_checkpoint(self.attn, x1) # bchw
+        x2 = maybe_checkpoint(self.mlp, self.norm2(x.permute(0, 2, 3, 1))) #bhwc
+        x2 = x2.permute(0, 3, 1, 2).contiguous(memory_format=fmt)
         x2 = x + x2
 
         return x2  
@@ -271,7 +343,76 @@ class FeedForward(nn.Module):
         return x
 
 
+def _attention_scores(q, k, chunk, eps=1e-12):
+    # Cosine similarity q_hat @ k_hat^T of (b, head, c, n) tensors, with F.normalize() semantics, from the raw Gram
+    # matrix and norms accumulated in (at least) fp32 over n in chunks: no normalized (b, head, c, n) copies are made
+    t = torch.promote_types(q.dtype, torch.float32)
+    if not chunk:  # single pass without slicing, for jit.trace and ONNX export at dynamic H*W
+        q, k = q.to(t), k.to(t)
+        gram, nq, nk = q @ k.transpose(-2, -1), q.square().sum(-1).sqrt(), k.square().sum(-1).sqrt()
+        iq, ik = 1 / nq.clamp(min=eps), 1 / nk.clamp(min=eps)
+        return gram * iq[..., None] * ik[..., None, :], gram, nq, nk, iq, ik
+    gram = q.new_zeros(*q.shape[:-1], k.shape[-2], dtype=t)
+    nq = q.new_zeros(q.shape[:-1], dtype=t)
+    nk = k.new_zeros(k.shape[:-1], dtype=t)
+    for i in range(0, q.shape[-1], chunk):
+        qi, ki = q[..., i:i + chunk].to(t), k[..., i:i + chunk].to(t)
+        gram += qi @ ki.transpose(-2, -1)
+        nq += qi.square().sum(-1)
+        nk += ki.square().sum(-1)
+    nq, nk = nq.sqrt(), nk.sqrt()
+    iq, ik = 1 / nq.clamp(min=eps), 1 / nk.clamp(min=eps)
+    return gram * iq[..., None] * ik[..., None, :], gram, nq, nk, iq, ik
+
+
+class ChunkedChannelAttention(torch.autograd.Function):
+    """
+    softmax(normalize(q) @ normalize(k)^T * temperature) @ v over (b, head, c, n) tensors in bounded memory.
+
+    Only q, k, v and the (c, c) attention are saved, normalized copies are recomputed chunk by chunk in backward.
+    """
+
+    @staticmethod
+    def forward(ctx, q, k, v, temperature, chunk):
+        with torch.autocast(q.device.type, enabled=False):
+            scores, gram, nq, nk, iq, ik = _attention_scores(q, k, chunk)
+            attn = (scores * temperature).softmax(dim=-1)
+            out = attn.to(v.dtype) @ v
+        ctx.save_for_backward(q, k, v, temperature, attn, scores, gram, nq, nk, iq, ik)
+        ctx.chunk = chunk
+        return out
+
+    @staticmethod
+    def backward(ctx, grad_out, eps=1e-12):
+        q, k, v, temperature, attn, scores, gram, nq, nk, iq, ik = ctx.saved_tensors
+        n, chunk, t = q.shape[-1], ctx.chunk, attn.dtype
+        with torch.autocast(q.device.type, enabled=False):
+            grad_attn = attn.new_zeros(attn.shape)
+            for i in range(0, n, chunk):
+                grad_attn += grad_out[..., i:i + chunk].to(t) @ v[..., i:i + chunk].to(t).transpose(-2, -1)
+            grad_logits = attn * (grad_attn - (grad_attn * attn).sum(-1, keepdim=True))  # softmax backward
+            grad_temperature = (grad_logits * scores).sum((0, 2, 3)).view_as(temperature)
+            grad_scores = grad_logits * temperature
+            grad_gram = grad_scores * iq[..., None] * ik[..., None, :]
+            # scores = gram * iq * ik with iq = 1 / max(|q|, eps), d iq / dq = -iq^2 * q / |q| where |q| > eps
+            giq = (grad_scores * gram * ik[..., None, :]).sum(-1)
+            gik = (grad_scores * gram * iq[..., None]).sum(-2)
+            cq = torch.where(nq > eps, -giq * iq * iq / nq.clamp(min=eps), torch.zeros_like(nq))[..., None]
+            ck = torch.where(nk > eps, -gik * ik * ik / nk.clamp(min=eps), torch.zeros_like(nk))[..., None]
+            grad_q, grad_k, grad_v = torch.empty_like(q), torch.empty_like(k), torch.empty_like(v)
+            attn_t, grad_gram_t = attn.transpose(-2, -1), grad_gram.transpose(-2, -1)
+            for i in range(0, n, chunk):
+                s = slice(i, i + chunk)
+                qi, ki, gi = q[..., s].to(t), k[..., s].to(t), grad_out[..., s].to(t)
+                grad_q[..., s] = grad_gram @ ki + cq * qi
+                grad_k[..., s] = grad_gram_t @ qi + ck * ki
+                grad_v[..., s] = attn_t @ gi
+        return grad_q, grad_k, grad_v, grad_temperature, None
+
+
 class Attention(nn.Module):
+    chunk = 1 << 16  # H*W tokens per chunk when accumulating the channel attention
+
     def __init__(self, dim, num_heads, bias):
         super(Attention, self).__init__()
         self.num_heads = num_heads
@@ -283,22 +424,19 @@ class Attention(nn.Module):
 
     def forward(self, x):
         b, c, h, w = x.shape
-        device = x.device
-        self.qkv = self.qkv.to(device)
-        self.qkv_dwconv = self.qkv_dwconv.to(device)
-        self.project_out = self.project_out.to(device)
         qkv = self.qkv(x)
         qkv = self.qkv_dwconv(qkv)
         q, k, v = qkv.chunk(3, dim=1)
-        q = rearrange(q, 'b (head c) h w -> b head c (h w)', head=self.num_heads)
-        k = rearrange(k, 'b (head c) h w -> b head c (h w)', head=self.num_heads)
-        v = rearrange(v, 'b (head c) h w -> b head c (h w)', head=self.num_heads)
-        q = torch.nn.functional.normalize(q, dim=-1)
-        k = torch.nn.functional.normalize(k, dim=-1)
-        attn = (q @ k.transpose(-2, -1)) * self.temperature.to(device)
-        attn = attn.softmax(dim=-1)
-        out = (attn @ v)
-        out = rearrange(out, 'b head c (h w) -> b (head c) h w', head=self.num_heads, h=h, w=w)
+        q = q.reshape(b, self.num_heads, c // self.num_heads, h * w)  # b (head c) h w -> b head c (h w)
+        k = k.reshape(b, self.num_heads, c // self.num_heads, h * w)
+        v = v.reshape(b, self.num_heads, c // self.num_heads, h * w)
+        tracing = torch.jit.is_tracing()
+        if torch.is_grad_enabled() and (qkv.requires_grad or self.temperature.requires_grad) and not tracing:
+            out = ChunkedChannelAttention.apply(q, k, v, self.temperature, self.chunk)  # recompute in backward
+        else:
+            attn = (_attention_scores(q, k, 0 if tracing else self.chunk)[0] * self.temperature).softmax(dim=-1)
+            out = attn.to(v.dtype) @ v
+        out = out.reshape(b, c, h, w)  # b head c (h w) -> b (head c) h w
         out = self.project_out(out)
         return out
 
@@ -425,6 +563,30 @@ class DFC(nn.Module):
         res = F.interpolate(res, size=original_size, mode='nearest')
         return res
 
+    def forward_fuse(self, x):
+        original_size = x.shape[-2:]
+        res = self.short_conv(F.avg_pool2d(x, kernel_size=2, stride=2))  # 1x1 conv, 5x5 depthwise conv
+        b, c, h, w = res.shape
+        # bias of the 1x5 stage as seen through the zero-padded 5x1 stage, varies by row near the top/bottom border
+        res = res + F.conv2d(res.new_ones(1, c, h, 1), self.row_bias, padding=(2, 0), groups=c)
+        res = self.gate_fn(res)
+        res = F.interpolate(res, size=original_size, mode='nearest')
+        return res
+
+    @torch.no_grad()
+    def fuse(self):
+        # Reparameterize conv-BN-dw1x5-BN-dw5x1-BN into a 1x1 conv and a single 5x5 depthwise conv for inference
+        s = self.short_conv
+        conv, conv_h, conv_v = (fuse_conv_and_bn(s[i], s[i + 1]) for i in (0, 2, 4))  # 1x1, 1x5, 5x1
+        c = conv_v.out_channels
+        dwconv = nn.Conv2d(c, c, kernel_size=5, stride=1, padding=2, groups=c, bias=True).requires_grad_(False)
+        dwconv = dwconv.to(conv_v.weight.device)
+        dwconv.weight.copy_(conv_v.weight * conv_h.weight)  # (c,1,5,1) * (c,1,1,5) outer product -> (c,1,5,5)
+        dwconv.bias.copy_(conv_v.bias)
+        self.short_conv = nn.Sequential(conv, dwconv)
+        self.register_buffer('row_bias', conv_v.weight * conv_h.bias.view(-1, 1, 1, 1))  # (c,1,5,1)
+        self.forward = self.forward_fuse
+
 class HSI_DFC(nn.Module):
     def __init__(self, inp):
         super(HSI_DFC, self).__init__()
@@ -498,23 +660,55 @@ class ContentDrivenPromptBlock(nn.Module):
         pattn1 = pattn1.unsqueeze(dim=2)  # [b,c,1,h,w]
         x = x.unsqueeze(dim=2)  # [b,c,1,h,w]
         x2 = torch.cat([x, pattn1], dim=2)  # [b,c,2,h,w]
-        x2 = Rearrange('b c t h w -> b (c t) h w')(x2)  # [b,c*2,h,w]
+        x2 = x2.flatten(1, 2)  # [b,c*2,h,w]  b c t h w -> b (c t) h w
         x2 = self.myshuffle(x2)  # [c1,c1_att,c2,c2_att,...]
         pattn2 = self.pa2(x2)
         pattn2 = self.conv1x1(pattn2)  # [b,prompt_dim,h,w]
         prompt_weight = self.sigmoid(pattn2)  # Sigmod
-        prompt_param = F.interpolate(prompt_param, (H, W), mode="bilinear")
+        if torch.jit.is_tracing() or prompt_param.shape[-2:] != (H, W):  # else resized by the SpatialIE prompt cache
+            prompt_param = F.interpolate(prompt_param, (H, W), mode="bilinear")
         # (b,prompt_dim,prompt_size,prompt_size) -> (b,prompt_dim,h,w)
         prompt = prompt_weight * prompt_param
         prompt = self.conv3x3(prompt)  # (b,prompt_dim,h,w)
         inter_x = torch.cat([x_, prompt], dim=1)  # (b,prompt_dim+dim,h,w)
         inter_x = self.out_conv1(inter_x)  # (b,dim,h,w) dim=64
-        inter_x = self.hsi_dfc(inter_x)
+        inter_x = maybe_checkpoint(self.hsi_dfc, inter_x)
 
         return inter_x
 
 
 
+def box_filter(x, r):
+    # Mean over a (2r+1) x (2r+1) window, borders averaged over valid pixels only
+    return F.avg_pool2d(x, 2 * r + 1, stride=1, padding=r, count_include_pad=False)
+
+
+def guided_upsample(x_lr, y_lr, x, r=2, eps=1e-4):
+    # Fast guided filter (He & Sun 2015, Wu et al. 2018): fit y_lr ~ a * x_lr + b per channel over local windows at
+    # low resolution, then apply the bilinearly upsampled per-pixel gain a and offset b to the full-resolution guide x
+    mean_x, mean_y = box_filter(x_lr, r), box_filter(y_lr, r)
+    cov_xy = box_filter(x_lr * y_lr, r) - mean_x * mean_y
+    var_x = box_filter(x_lr * x_lr, r) - mean_x * mean_x
+    a = cov_xy / (var_x + eps)
+    b = mean_y - a * mean_x
+    ab = F.interpolate(torch.cat([a, b], 1), x.shape[-2:], mode='bilinear', align_corners=False)
+    a, b = ab.chunk(2, 1)
+    return a * x + b
+
+
+def degradation_score(x, size=64):
+    # Per-image degradation score in [0, 1] from cheap statistics of a size x size thumbnail of the 0-1 RGB input:
+    # low light (dark mean luminance), haze (bright dark channel, He et al. 2009) and low contrast (flat luminance).
+    # Clean daylight frames score near 0
+    t = F.adaptive_avg_pool2d(x[:, :3].float(), size)
+    lum = (t * t.new_tensor([0.299, 0.587, 0.114]).view(1, 3, 1, 1)).sum(1).flatten(1)  # (b,size*size)
+    dark = -F.max_pool2d(-t.amin(1, keepdim=True), 7, 1, 3)  # dark channel, 7x7 min filter
+    low_light = 1 - lum.mean(1) / 0.4
+    haze = (dark.flatten(1).mean(1) - 0.1) / 0.4
+    low_contrast = 1 - lum.std(1) / 0.2
+    return torch.stack([low_light, haze, low_contrast], 1).clamp(0, 1).amax(1)  # (b,)
+
+
 class HalveChannels(nn.Module):
     def __init__(self, in_channels):
         super(HalveChannels, self).__init__()
@@ -529,7 +723,12 @@ class ToRGB(nn.Module):
     def forward(self, x):
         # 确保卷积层的输入通道数与输入张量的通道数匹配
         if self.conv.in_channels != x.shape[1]:
-            self.conv = nn.Conv2d(x.shape[1], 3, kernel_size=1, stride=1, padding=0, bias=False)
+            self.conv = nn.Conv2d(x.shape[1], self.conv.out_channels, kernel_size=1, stride=1, padding=0,
+                                  bias=False).to(x.device)
+        return self.conv(x)
+
+    def forward_fuse(self, x):
+        # Static forward for deployed models, conv input channels already match
         return self.conv(x)
 
 
@@ -538,76 +737,519 @@ class ToRGB(nn.Module):
 # SpatialIE
 
 class SpatialIE(nn.Module):
-    def __init__(self, c_in=3, c_out=3, dim=4, prompt_inch=128, prompt_size=32):
+    deployed = False  # static inference graph, see deploy()
+    tile = 0  # tiled inference tile size in pixels, 0 to disable, see tiling()
+    checkpoint = ''  # training activation checkpointing granularity, see checkpointing()
+    scale = 1.0  # enhancer input scale, <1 runs at reduced resolution with guided upsampling
+    guide_r, guide_eps = 2, 1e-4  # guided filter radius and regularization at reduced resolution
+    levels = 3  # encoder downsamplings
+    gate = 0.0  # inference bypass threshold on degradation_score(), 0 to disable, see gating()
+    stream = 0  # video streaming mode deep feature refresh interval in frames, 0 to disable, see streaming()
+
+    def __init__(self, c_in=3, c_out=3, dim=4, prompt_inch=128, prompt_size=32, scale=1.0, levels=3, kan=True):
+        # levels: number of 2x encoder downsamplings (1-3), kan: KANsformer (True) or MLP transformer at level 3
         super(SpatialIE, self).__init__()
+        assert scale == 1 or c_in == c_out, 'SpatialIE scale<1 uses the input image as guide, requires c_in == c_out'
+        assert 1 <= levels <= 3, f'SpatialIE levels={levels} must be in 1-3'
+        self.scale = scale
+        self.levels = levels
         #self.patch_embed = OverlapPatchEmbed(c_in, dim)
         self.conv0 = RFAConv(c_in, dim)
-        self.conv1 = TransformerBlockBackbone(dim, 1, bias=False)
-        self.conv2 = TransformerBlockBackbone(dim * 2, 2, bias=False)
-        self.conv3 = KANsformer(dim * 4, 4, bias=False)
-        self.conv4 = TransformerBlockBackbone(dim * 8, 8, bias=False)
-        self.conv5 = TransformerBlockBackbone(dim * 8, 4, bias=False)
-        self.conv6 = TransformerBlockBackbone(dim * 4, 2, bias=False)
-        self.conv7 = TransformerBlockBackbone(dim * 2, 1, bias=False)
-        self.halvechannels1 = HalveChannels(dim * 8)
-        self.halvechannels2 = HalveChannels(dim * 4)
-        self.toRGB = ToRGB(dim * 4, 3)
-        self.down1 = Downsample(dim)
-        self.down2 = Downsample(dim * 2)
-        self.down3 = Downsample(dim * 4)
+        for i in range(levels + 1):  # encoder conv1-conv4, (b,dim*2^i,h/2^i,w/2^i)
+            block = KANsformer if i == 2 and kan else TransformerBlockBackbone
+            setattr(self, f'conv{i + 1}', block(dim * 2 ** i, 2 ** i, bias=False))
+        for i in range(levels, 0, -1):  # decoder conv5-conv7 on the level i concat
+            setattr(self, f'conv{8 - i}', TransformerBlockBackbone(dim * 2 ** i, 2 ** (i - 1), bias=False))
+        for i in range(levels, 1, -1):
+            setattr(self, f'halvechannels{4 - i}', HalveChannels(dim * 2 ** i))
+        self.toRGB = ToRGB(dim * 2, c_out)  # conv7 outputs dim * 2 channels
+        for i in range(1, levels + 1):
+            setattr(self, f'down{i}', Downsample(dim * 2 ** (i - 1)))
         self.prompt_param_ini = nn.Parameter(torch.rand(1, prompt_inch, prompt_size, prompt_size))  # (b,c,h,w)
-        self.myPromptParamGen = CotPromptParaGen(prompt_inch=prompt_inch, prompt_size=prompt_size)
-        self.prompt1 = ContentDrivenPromptBlock(dim=dim * 2 ** 1, prompt_dim=prompt_inch // 4, reduction=8)  # !!!!
-        self.prompt2 = ContentDrivenPromptBlock(dim=dim * 2 ** 2, prompt_dim=prompt_inch // 2, reduction=8)
-        self.prompt3 = ContentDrivenPromptBlock(dim=dim * 2 ** 3, prompt_dim=prompt_inch, reduction=8)
-        self.up3 = Upsample(dim * 8)
-        self.up2 = Upsample(dim * 4)
-        self.up1 = Upsample(dim * 2)
+        self.myPromptParamGen = CotPromptParaGen(prompt_inch=prompt_inch, prompt_size=prompt_size, num_path=levels)
+        for i in range(1, levels + 1):  # prompt{levels} at the bottleneck gets the full prompt_inch
+            prompt_dim = prompt_inch // 2 ** (levels - i)
+            setattr(self, f'prompt{i}', ContentDrivenPromptBlock(dim=dim * 2 ** i, prompt_dim=prompt_dim, reduction=8))
+        for i in range(levels, 0, -1):
+            setattr(self, f'up{i}', Upsample(dim * 2 ** i))
+        self._prompt_cache = {}  # eval-mode prompt pyramid cache, see _prompt_params()
+        self._stream = {}  # streaming mode deep feature cache, see streaming()
+
+    @property
+    def stride(self):
+        return 2 ** self.levels  # input sizes must be multiples of the stride
+
+    def __setstate__(self, state):
+        # Checkpoints pickled before the prompt cache existed
+        super().__setstate__(state)
+        self.__dict__.setdefault('_prompt_cache', {})
+        self.__dict__.setdefault('_stream', {})
+
+    def train(self, mode=True):
+        self._prompt_cache, self._stream = {}, {}  # invalidate prompt and stream caches
+        return super().train(mode)
+
+    def _apply(self, fn, *args, **kwargs):
+        # to(), cpu(), cuda(), half() move parameters, drop prompts and features cached on the old device/dtype
+        self._prompt_cache, self._stream = {}, {}
+        return super()._apply(fn, *args, **kwargs)
+
+    def _prompt_params(self, sizes):
+        # Return prompt_params[0..levels-1] resized to sizes, deepest first. The prompt chain does not depend on the
+        # input image, so in eval/no_grad mode it is computed once and memoized per feature-map resolution
+        if self.deployed:
+            sources = [getattr(self, f'prompt_param_fused{i}') for i in range(self.levels)]
+            if torch.jit.is_tracing() or is_compiling():
+                return sources  # resized per block, keeps the cache out of static graphs
+        elif self.training or torch.is_grad_enabled():
+            return self.myPromptParamGen(self.prompt_param_ini)[:self.levels]  # resized inside ContentDrivenPromptBlock
+        else:
+            sources = [self.prompt_param_ini, *self.myPromptParamGen.parameters()]
+        key = tuple((p.data_ptr(), 0 if p.is_inference() else p._version)  # inference tensors have no version counter
+                    for p in sources)
+        if self._prompt_cache.get('key') != key:  # parameters updated or loaded
+            params = sources if self.deployed else self.myPromptParamGen(self.prompt_param_ini)
+            self._prompt_cache = {'key': key, 'params': params}
+        prompts = []
+        for i, size in enumerate(sizes):
+            k = (i, *size)
+            if k not in self._prompt_cache:
+                p = self._prompt_cache['params'][i]
+                self._prompt_cache[k] = p if p.shape[-2:] == size else F.interpolate(p, size, mode='bilinear')
+            prompts.append(self._prompt_cache[k])
+        return prompts
+
     def forward(self, x):  # (b,c_in,h,w)
-        prompt_params = self.myPromptParamGen(self.prompt_param_ini)
-        prompt_param1 = prompt_params[2]  # [1, 64, 64, 64]
-        prompt_param2 = prompt_params[1]  # [1, 128, 32, 32]
-        prompt_param3 = prompt_params[0]  # [1, 256, 16, 16]
+        if self.gate and not self.training:
+            return self._forward_gated(x)
+        return self._forward(x)
+
+    def _forward(self, x):
+        if self.scale < 1:
+            return self._forward_guided(x)
+        return self._enhance(x)
+
+    def gating(self, threshold=0.3):
+        """
+        Enable the content-adaptive bypass gate (eval mode only), routing clean frames around the enhancer.
+
+        Every image gets a degradation_score() in [0, 1] from thumbnail statistics (low light, haze, low contrast) and
+        images scoring below `threshold` are passed through unchanged, so the enhancer only runs on the degraded part
+        of each batch. Requires c_in == c_out. Routing is data dependent, disable it before jit.trace or export.
+        Routed frame counts accumulate in `gate_stats` as [seen, bypassed]. Use threshold=0 to disable.
+        """
+        c_in, c_out = self.conv0.get_weight[1].in_channels, self.toRGB.conv.out_channels
+        assert not threshold or c_in == c_out, (
+            f'SpatialIE gating passes clean frames through, requires c_in == c_out, not {c_in} and {c_out}'
+        )
+        self.gate = float(threshold)
+        self.gate_stats = [0, 0]
+        return self
+
+    def _forward_gated(self, x):
+        enhance = degradation_score(x) >= self.gate  # (b,) bool
+        n = int(enhance.sum())
+        self.gate_stats[0] += len(x)
+        self.gate_stats[1] += len(x) - n
+        if n == len(x):  # all degraded
+            return self._forward(x)
+        if n == 0:  # all clean
+            return x
+        y = x.clone()
+        y[enhance] = self._forward(x[enhance]).to(y.dtype)
+        return y
+
+    def _enhance(self, x):
+        if self.tile and not self.training and max(x.shape[-2:]) > self.tile:
+            return self._forward_tiled(x)
+        if self.stream and not self.training:
+            return self._forward_stream(x)
+        return self._forward_once(x)
+
+    def streaming(self, interval=8, thres=0.05, level=None):
+        """
+        Enable streaming mode for video (eval mode only), reusing the deep low-resolution features across frames.
+
+        Global illumination and haze change slowly between consecutive frames, so the encoder below `level`, the deep
+        prompt blocks and the decoder up to that level are computed on refresh frames only and cached. Other frames
+        run just the high-resolution encoder levels 1..level and the decoder from `level` up. A refresh happens every
+        `interval` frames, when the input shape changes or on a scene change, i.e. when the mean absolute difference
+        of 32x32 thumbnails to the last refresh frame exceeds `thres`. The default level is one above the bottleneck
+        (level 2 of 3), caching the bottleneck alone saves little as level 3 holds the KANsformer. A lower `level`
+        reuses more of the network. Use interval=0 to disable.
+        """
+        assert level is None or 1 <= level <= self.levels, f'SpatialIE stream level {level} must be in 1-{self.levels}'
+        self.stream = int(interval)
+        self.stream_thres = float(thres)
+        self.stream_level = level or max(self.levels - 1, 1)
+        self._stream = {}
+        return self
+
+    def _forward_stream(self, x):
+        thumb = F.adaptive_avg_pool2d(x.float(), 32)
+        s = self._stream
+        expired = s.get('shape') != x.shape or s['age'] >= self.stream
+        if expired or (thumb - s['thumb']).abs().mean() > self.stream_thres:  # or scene change
+            self._stream = s = {'shape': x.shape, 'thumb': thumb, 'age': 0}  # refresh, features computed below
+        s['age'] += 1
+        return self._forward_once(x, stream=s)
+
+    def _forward_guided(self, x):
+        # Enhance a downscaled copy, then transfer the correction to full resolution as a guided per-pixel gain/offset
+        h, w = x.shape[-2:]
+        s = self.stride
+        size = max(round(h * self.scale / s), 1) * s, max(round(w * self.scale / s), 1) * s
+        x_lr = F.interpolate(x, size, mode='bilinear', align_corners=False, antialias=True)
+        return guided_upsample(x_lr, self._enhance(x_lr), x, self.guide_r, self.guide_eps)
+
+    def _forward_once(self, x, prompts=None, stream=None):  # prompts: deepest first, already resized, used by tiling
+        # stream: streaming mode cache, holds the decoder input at stream_level once computed, see streaming()
+        L = self.levels
+        k = self.stream_level if stream is not None else L
+        reuse = stream is not None and 'feat' in stream
         #x0 = self.patch_embed(x)  # (b,dim,h,w)
-        x0 = self.conv0(x)
-        x1 = self.conv1(x0)  # (b,dim,h,w)
-        x1_down = self.down1(x1)  # (b,dim,h/2,w/2)
-        x2 = self.conv2(x1_down)  # (b,dim,h/2,w/2)
-        x2_down = self.down2(x2)
-        x3 = self.conv3(x2_down)
-        x3_down = self.down3(x3)
-        x4 = self.conv4(x3_down)
-        device = x4.device
-        self.prompt1 = self.prompt1.to(device)
-        self.prompt2 = self.prompt2.to(device)
-        self.prompt3 = self.prompt3.to(device)
-        x4_prompt = self.prompt3(x4, prompt_param3)
-        x3_up = self.up3(x4_prompt)
-        x5 = self.conv5(torch.cat([x3_up, x3], 1))
-        x5 = self.halvechannels1(x5)
-        x5_prompt = self.prompt2(x5, prompt_param2)
-        x2_up = self.up2(x5_prompt)
-        x2_cat = torch.cat([x2_up, x2], 1)
-        x6 = self.conv6(x2_cat)
-        x6 = self.halvechannels2(x6)
-        x6_prompt = self.prompt1(x6, prompt_param1)
-        x1_up = self.up1(x6_prompt)
-        x7 = self.conv7(torch.cat([x1_up, x1], 1))
-        x7 = self.toRGB(x7)
-
-        return x7
+        x = self.conv0(x)
+        h, w = x.shape[-2] >> L, x.shape[-1] >> L  # bottleneck size
+        skips = []
+        for i in range(1, (k if reuse else L) + 1):
+            x = maybe_checkpoint(getattr(self, f'conv{i}'), x)  # (b,dim*2^(i-1),h/2^(i-1),w/2^(i-1))
+            skips.append(x)
+            if i < k or not reuse:
+                x = getattr(self, f'down{i}')(x)
+        if not reuse:
+            x = maybe_checkpoint(getattr(self, f'conv{L + 1}'), x)
+        prompts = prompts or self._prompt_params(
+            [(h << j, w << j) for j in range(L)])  # [1, 256, 16, 16], [1, 128, 32, 32], [1, 64, 64, 64]
+        for i, prompt in zip(range(L, 0, -1), prompts):
+            if reuse and i >= k:
+                if i > k:
+                    continue
+                x = stream['feat']  # cached prompt-modulated, upsampled deep features
+            else:
+                x = maybe_checkpoint(getattr(self, f'prompt{i}'), x, prompt)
+                x = getattr(self, f'up{i}')(x)
+                if stream is not None and i == k:
+                    stream['feat'] = x
+            x = maybe_checkpoint(getattr(self, f'conv{8 - i}'), torch.cat([x, skips.pop()], 1))
+            if i > 1:
+                x = getattr(self, f'halvechannels{4 - i}')(x)
+        x = self.toRGB(x)
+
+        return x
 
+    def checkpointing(self, granularity='stage'):
+        """
+        Enable activation checkpointing of the enhancer during training, trading compute for memory.
+
+        'stage' checkpoints the conv1-conv7 transformer stages and the prompt blocks as whole units, keeping only stage
+        inputs. 'block' instead checkpoints their sub-blocks (Attention, MLP/KAN and HSI_DFC), keeping more boundary
+        tensors but with a lower peak while a segment is recomputed. Either costs about one extra enhancer forward per
+        step.
+        Use '' to disable.
+        """
+        assert granularity in ('', 'stage', 'block'), f'invalid SpatialIE checkpoint granularity {granularity}'
+        assert TORCH_2_1 or not granularity, (
+            f'SpatialIE activation checkpointing requires torch>=2.1, not {torch.__version__}'
+        )
+        blocks = TransformerBlockBackbone, KANsformer, ContentDrivenPromptBlock
+        stages = [m for m in self.children() if isinstance(m, blocks)]
+        for m in stages:
+            m.checkpoint = granularity == 'stage'
+            for sub in m.modules():
+                if isinstance(sub, (Attention, Mlp, KAN, HSI_DFC)):
+                    sub.checkpoint = granularity == 'block'
+        self.checkpoint = granularity
+        return self
+
+    def tiling(self, tile=512, overlap=32, batch=4, workers=1):
+        """
+        Enable memory-bounded tiled inference (eval mode only) for inputs larger than `tile`.
+
+        The image is split into `tile` x `tile` crops overlapping by `overlap` pixels (both rounded to multiples of the
+        enhancer stride), crops are pushed through the network `batch` at a time on `workers` threads and blended
+        back with a linear ramp over the overlap, so peak activation memory depends on tile * batch * workers only.
+
+        Tiled output is not bit-identical to full-frame output. Convolutions, LayerNorm, KAN/MLP and the prompt maps
+        (bilinearly resampled from the full-frame resize) are exact away from the tile borders, but Attention
+        normalizes q/k and forms its C x C attention over the H*W extent it is given, and ChannelAttention/DFC pool
+        globally, so these statistics become per-tile. Differences are therefore low-frequency and shrink as `tile`
+        grows; pick the largest tile that fits memory and an overlap of at least 32 to hide the receptive-field seams.
+        Use tile=0 to disable.
+        """
+        s = self.stride
+        self.tile = int(tile) // s * s
+        self.tile_overlap = min(int(overlap) // s * s, self.tile // 2)
+        self.tile_batch = max(int(batch), 1)
+        self.tile_workers = max(int(workers), 1)
+        return self
+
+    @staticmethod
+    def _tile_starts(n, tile, step):
+        # Tile start offsets covering range(n), last tile flush with the border
+        starts = list(range(0, max(n - tile, 0), step))
+        return starts + [max(n - tile, 0)]
+
+    @staticmethod
+    def _crop_prompt(p, size, full, offset):
+        # Crop of F.interpolate(p, full, mode='bilinear') at offset with shape size, sampled without materializing
+        # the full-frame resize (grid_sample with align_corners=False and border padding matches interpolate)
+        (h, w), (fh, fw), (y0, x0) = size, full, offset
+        gy = (torch.arange(y0, y0 + h, device=p.device, dtype=p.dtype) + 0.5) / fh * 2 - 1
+        gx = (torch.arange(x0, x0 + w, device=p.device, dtype=p.dtype) + 0.5) / fw * 2 - 1
+        grid = torch.stack(torch.meshgrid(gx, gy, indexing='xy'), -1)[None]  # (1,h,w,2) as (x, y)
+        return F.grid_sample(p, grid, mode='bilinear', padding_mode='border', align_corners=False)
+
+    def _forward_tiled(self, x):
+        b, _, H, W = x.shape
+        th, tw = min(self.tile, H), min(self.tile, W)  # tile clipped to image
+        step_y, step_x = max(th - self.tile_overlap, self.stride), max(tw - self.tile_overlap, self.stride)
+        boxes = [(y, x_) for y in self._tile_starts(H, th, step_y) for x_ in self._tile_starts(W, tw, step_x)]
+
+        # Blending window: linear ramp over the overlap, strictly positive so normalization is always defined
+        ramp = lambda n: torch.minimum(torch.arange(1, n + 1), torch.arange(n, 0, -1)).clamp(max=self.tile_overlap + 1)
+        window = (ramp(th)[:, None] * ramp(tw)[None]).to(x)  # (th,tw)
+
+        if self.deployed:
+            sources = [getattr(self, f'prompt_param_fused{i}') for i in range(self.levels)]
+        else:
+            sources = self.myPromptParamGen(self.prompt_param_ini)[:self.levels]
+        scales = [self.stride >> j for j in range(self.levels)]  # prompt feature strides, deepest first
+
+        grad, inference = torch.is_grad_enabled(), torch.is_inference_mode_enabled()  # thread-local, see run()
+
+        def run(chunk):
+            # chunk: list of (image index, y, x). Pool threads start with grad enabled, re-enter the caller's modes
+            with torch.inference_mode(inference), torch.set_grad_enabled(grad):
+                crops = torch.cat([x[i:i + 1, :, y:y + th, x_:x_ + tw] for i, y, x_ in chunk], 0)
+                y0, x0 = chunk[0][1:]  # prompts vary with position only, share them when the chunk is one position
+                if all(c[1:] == (y0, x0) for c in chunk):
+                    prompts = [self._crop_prompt(p, (th // s, tw // s), (H // s, W // s), (y0 // s, x0 // s))
+                               for p, s in zip(sources, scales)]
+                else:
+                    prompts = [torch.cat([self._crop_prompt(p, (th // s, tw // s), (H // s, W // s), (y // s, x_ // s))
+                                          for _, y, x_ in chunk]) for p, s in zip(sources, scales)]
+                return chunk, self._forward_once(crops, prompts)
+
+        jobs = [(i, y, x_) for y, x_ in boxes for i in range(b)]  # image-major within a position
+        chunks = [jobs[i:i + self.tile_batch] for i in range(0, len(jobs), self.tile_batch)]
+        out, weight = None, x.new_zeros(1, 1, H, W)
+        for y, x_ in boxes:
+            weight[..., y:y + th, x_:x_ + tw] += window
+        pool = ThreadPoolExecutor(self.tile_workers) if self.tile_workers > 1 else None
+        for chunk, pred in (pool.map(run, chunks) if pool else map(run, chunks)):
+            if out is None:
+                out = x.new_zeros(b, pred.shape[1], H, W)
+            for (i, y, x_), p in zip(chunk, pred):
+                out[i, :, y:y + th, x_:x_ + tw] += p * window
+        if pool:
+            pool.shutdown()
+        return out / weight
+
+    @torch.no_grad()
+    def deploy(self):
+        # Convert to a static inference graph for torch.jit.trace, torch.compile(fullgraph=True) and ONNX export:
+        # BatchNorm2d() layers are folded into convolutions, the input-independent prompt chain is frozen into buffers
+        # and dynamic layer rebuilds are removed
+        if self.deployed:
+            return self
+        for m in self.modules():
+            if isinstance(m, (RFAConv, DFC)):
+                m.fuse()  # Conv2d() + BatchNorm2d() reparameterization
+        for i, p in enumerate(self.myPromptParamGen(self.prompt_param_ini)[:self.levels]):
+            self.register_buffer(f'prompt_param_fused{i}', p.detach().clone())
+        self.toRGB.forward = self.toRGB.forward_fuse
+        self._prompt_cache = {}
+        self.deployed = True
+        return self
+
+    @torch.no_grad()
+    def profile(self, x, n=10, save=None, verbose=True):
+        """
+        Profile the enhancer per stage in eval mode: latency (ms), GFLOPs, parameters and peak activation memory (MB).
+
+        Stages are the direct children (RFAConv, transformer blocks, down/up, prompt blocks, ToRGB) and the HSI_DFC of
+        each prompt block, in execution order. Nested rows are also counted in their parent. FLOPs come from torch
+        FlopCounterMode, which counts the convolutions and matmuls inside Attention and KAN that thop misses.
+        Elementwise ops are not counted, except the KANLinear B-spline bases, added analytically as
+        in_features * (grid_size + spline_order) * spline_order per token (none after freeze_to_lut()). Peak memory
+        is the largest total of tensors allocated while the stage runs, excluding its input. Returns a list of dicts
+        and saves them to `save` (*.csv or *.json) if given, an empty list on torch<2.1.
+        """
+        if not TORCH_2_1:
+            LOGGER.warning(f'WARNING ⚠️ SpatialIE stage profiling requires torch>=2.1, not {torch.__version__}')
+            return []
+        from torch.utils.flop_counter import FlopCounterMode
+
+        training = self.training
+        self.eval()
+        stages = {k: m for k, m in self.named_modules() if k and ('.' not in k or isinstance(m, HSI_DFC))}
+        kans = {k: m for k, m in self.named_modules() if isinstance(m, KANLinear)}
+        rows, t0, stack, spline = {}, {}, [], dict.fromkeys(kans, 0)
+        mem = None
+
+        def pre(name):
+            def hook(m, args):
+                rows.setdefault(name, {'stage': name, 'module': type(m).__name__, 'time (ms)': 0.0})
+                if mem is None:  # timing pass
+                    t0[name] = time_sync()
+                else:  # FLOPs and memory pass, the stage peak starts from the current live total
+                    stack.append((mem.live, mem.peak))
+                    mem.peak = mem.live
+            return hook
+
+        def post(name):
+            def hook(m, args, out):
+                if mem is None:
+                    rows[name]['time (ms)'] += (time_sync() - t0[name]) * 1E3 / n
+                else:
+                    live, peak = stack.pop()
+                    rows[name]['peak (MB)'] = (mem.peak - live) / 1E6
+                    mem.peak = max(peak, mem.peak)
+                    rows[name]['output'] = tuple(out.shape)
+            return hook
+
+        def count_splines(name):
+            def hook(m, args):
+                if mem is not None and m.lut is None:  # FLOPs pass, lookup tables skip the B-spline bases
+                    spline[name] += len(args[0]) * m.in_features * (m.grid_size + m.spline_order) * m.spline_order
+            return hook
+
+        handles = [h for k, m in stages.items() for h in (m.register_forward_pre_hook(pre(k)),
+                                                          m.register_forward_hook(post(k)))]
+        handles += [m.register_forward_pre_hook(count_splines(k)) for k, m in kans.items()]
+        try:
+            self(x)  # warmup, fills the prompt cache
+            rows.clear()
+            t = time_sync()
+            for _ in range(n):
+                self(x)
+            t = (time_sync() - t) * 1E3 / n
+            with FlopCounterMode(display=False) as flop_counter, PeakMemory() as mem:
+                self(x)
+        finally:
+            for h in handles:
+                h.remove()
+            self.train(training)
+
+        flops = flop_counter.get_flop_counts()
+        root = type(self).__name__
+        for k, r in rows.items():
+            r['GFLOPs'] = (sum(flops.get(f'{root}.{k}', {}).values()) +
+                           sum(v for name, v in spline.items() if name.startswith(f'{k}.'))) / 1E9
+            r['params'] = sum(p.numel() for p in stages[k].parameters())
+        rows = list(rows.values()) + [{'stage': 'total', 'module': root, 'time (ms)': t,
+                                       'peak (MB)': mem.peak / 1E6, 'output': tuple(x.shape),
+                                       'GFLOPs': (sum(flops.get('Global', {}).values()) + sum(spline.values())) / 1E9,
+                                       'params': sum(p.numel() for p in self.parameters())}]
+        if verbose:
+            self.print_profile(rows)
+        if save:
+            keys = ['stage', 'module', 'time (ms)', 'GFLOPs', 'params', 'peak (MB)', 'output']
+            with open(save, 'w', newline='') as f:
+                if str(save).endswith('.json'):
+                    json.dump([{k: r[k] for k in keys} for r in rows], f, indent=2)
+                else:
+                    w = csv.DictWriter(f, keys)
+                    w.writeheader()
+                    w.writerows(rows)
+        return rows
+
+    @staticmethod
+    def print_profile(rows):
+        LOGGER.info(f"{'stage':>22}{'module':>26}{'time (ms)':>11}{'GFLOPs':>10}"
+                    f"{'params':>10}{'peak (MB)':>11}  output")
+        for r in rows:
+            LOGGER.info(f"{r['stage']:>22}{r['module']:>26}{r['time (ms)']:>11.2f}{r['GFLOPs']:>10.3f}"
+                        f"{r['params']:>10}{r['peak (MB)']:>11.1f}  {r['output']}")
 
 
 
-if __name__ == "__main__":
 
-    # Generating Sample image
-    image_size = (1, 3, 640, 640)
-    image = torch.rand(*image_size)
-    out = SpatialIE(3, 3, 4)
-    out = out(image)
-    print(out.size())
+if __name__ == "__main__":
+    # Benchmark reduced-resolution enhancement, i.e. python -m models.modules.SpatialIE --img 1280 --scales 1 0.5 0.25
+    # and NCHW vs channels_last layout copies, i.e. python -m models.modules.SpatialIE --img 640 --channels-last
+    # or profile per stage, i.e. python -m models.modules.SpatialIE --img 640 --profile stages.csv
+    import argparse
+    import time
+
+    from torch.utils._python_dispatch import TorchDispatchMode
+
+    class CopyCounter(TorchDispatchMode):
+        # Count bytes written by tensor copies (clone, contiguous, to) dispatched during a forward pass
+        def __init__(self):
+            super().__init__()
+            self.bytes = 0
+
+        def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+            out = func(*args, **(kwargs or {}))
+            if func in (torch.ops.aten.clone.default, torch.ops.aten._to_copy.default):
+                self.bytes += out.numel() * out.element_size()
+            return out
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--img', type=int, default=640, help='square input size (pixels)')
+    parser.add_argument('--batch-size', type=int, default=1, help='batch size')
+    parser.add_argument('--scales', nargs='+', type=float, default=[1.0], help='SpatialIE scale values to compare')
+    parser.add_argument('--runs', type=int, default=3, help='timed runs per scale')
+    parser.add_argument('--channels-last', action='store_true', help='compare NCHW and channels_last layouts')
+    parser.add_argument('--checkpoint', action='store_true', help='compare training activation checkpointing')
+    parser.add_argument('--profile', nargs='?', const='', default=None, help='per-stage profile, optional *.csv/*.json')
+    opt = parser.parse_args()
+
+    image = torch.rand(opt.batch_size, 3, opt.img, opt.img)
+    model = SpatialIE(3, 3, 4).eval()
+    if opt.profile is not None:
+        model.profile(image, n=opt.runs, save=opt.profile)
+    ref, t_ref = None, None
+    print(f"{'scale':>8}{'time (ms)':>12}{'speedup':>10}{'PSNR (dB)':>12}")
+    with torch.no_grad():
+        for scale in opt.scales:
+            model.scale = scale
+            model(image)  # warmup
+            t = time.perf_counter()
+            for _ in range(opt.runs):
+                out = model(image)
+            t = (time.perf_counter() - t) / opt.runs * 1E3
+            if ref is None:  # quality is measured against the first (reference) scale
+                ref, t_ref = out, t
+            mse = (out - ref).pow(2).mean().item()
+            psnr = 10 * math.log10(ref.abs().max().item() ** 2 / mse) if mse else float('inf')
+            print(f'{scale:>8.3g}{t:>12.1f}{t_ref / t:>10.2f}{psnr:>12.2f}')
+
+    if opt.channels_last:
+        model.scale = 1.0
+        print(f"\n{'layout':>18}{'time (ms)':>12}{'copies (MB)':>14}")
+        with torch.no_grad():
+            for fmt in (torch.contiguous_format, torch.channels_last):
+                model.to(memory_format=fmt)
+                im = image.contiguous(memory_format=fmt)
+                model(im)  # warmup
+                t = time.perf_counter()
+                for _ in range(opt.runs):
+                    model(im)
+                t = (time.perf_counter() - t) / opt.runs * 1E3
+                with CopyCounter() as counter:
+                    model(im)
+                print(f'{str(fmt)[6:]:>18}{t:>12.1f}{counter.bytes / 1E6:>14.1f}')
+        model.to(memory_format=torch.contiguous_format)
+
+    if opt.checkpoint:  # forward + backward in training mode
+        model.scale = 1.0
+        model.train()
+        print(f"\n{'checkpoint':>12}{'time (ms)':>12}{'peak (MB)':>12}{'compute':>10}{'memory':>10}")
+        t_ref, m_ref = None, None
+        for granularity in ('', 'stage', 'block'):
+            model.checkpointing(granularity)
+            model(image).mean().backward()  # warmup
+            t = time.perf_counter()
+            for _ in range(opt.runs):
+                model(image).mean().backward()
+            t = (time.perf_counter() - t) / opt.runs * 1E3
+            with PeakMemory() as mem:
+                model(image).mean().backward()
+            t_ref, m_ref = t_ref or t, m_ref or mem.peak
+            print(f"{granularity or 'none':>12}{t:>12.1f}{mem.peak / 1E6:>12.1f}"
+                  f"{t / t_ref:>10.2f}{mem.peak / m_ref:>10.2f}")
 
 
 
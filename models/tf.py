@@ -25,6 +25,7 @@ import numpy as np
 import tensorflow as tf
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from tensorflow import keras
 
 from models.common import (
@@ -43,9 +44,11 @@ from models.common import (
     autopad,
 )
 from models.experimental import MixConv2d, attempt_load
+from models.modules.SpatialIE import KANsformer, SpatialIE
 from models.yolo import Detect, Segment
 from utils.activations import SiLU
 from utils.general import LOGGER, make_divisible, print_args
+from utils.torch_utils import smart_inference_mode
 
 
 class TFBN(keras.layers.Layer):
@@ -66,15 +69,16 @@ class TFBN(keras.layers.Layer):
 
 class TFPad(keras.layers.Layer):
     # Pad inputs in spatial dimensions 1 and 2
-    def __init__(self, pad):
+    def __init__(self, pad, mode="constant"):
         super().__init__()
         if isinstance(pad, int):
             self.pad = tf.constant([[0, 0], [pad, pad], [pad, pad], [0, 0]])
         else:  # tuple/list
             self.pad = tf.constant([[0, 0], [pad[0], pad[0]], [pad[1], pad[1]], [0, 0]])
+        self.mode = mode  # 'constant' (zeros) or 'reflect'
 
     def call(self, inputs):
-        return tf.pad(inputs, self.pad, mode="constant", constant_values=0)
+        return tf.pad(inputs, self.pad, mode=self.mode, constant_values=0)
 
 
 class TFConv(keras.layers.Layer):
@@ -205,9 +209,10 @@ class TFConv2d(keras.layers.Layer):
             kernel_initializer=keras.initializers.Constant(w.weight.permute(2, 3, 1, 0).numpy()),
             bias_initializer=keras.initializers.Constant(w.bias.numpy()) if bias else None,
         )
+        self.pad = TFPad(w.padding, pad_mode(w)) if any(w.padding) else tf.identity
 
     def call(self, inputs):
-        return self.conv(inputs)
+        return self.conv(self.pad(inputs))
 
 
 class TFBottleneckCSP(keras.layers.Layer):
@@ -399,6 +404,368 @@ class TFConcat(keras.layers.Layer):
         return tf.concat(inputs, self.d)
 
 
+class TFDWConv2d(keras.layers.Layer):
+    # Substitution for PyTorch depthwise nn.Conv2d (groups == in_channels)
+    def __init__(self, w=None):
+        super().__init__()
+        c1, c2, (kh, kw) = w.in_channels, w.out_channels, w.kernel_size
+        assert w.groups == c1, "TFDWConv2d() requires groups == in_channels"
+        self.conv = keras.layers.DepthwiseConv2D(
+            kernel_size=(kh, kw),
+            depth_multiplier=c2 // c1,
+            strides=w.stride,
+            padding="VALID",
+            use_bias=w.bias is not None,
+            depthwise_initializer=keras.initializers.Constant(
+                w.weight.view(c1, c2 // c1, kh, kw).permute(2, 3, 0, 1).numpy()
+            ),
+            bias_initializer=keras.initializers.Constant(w.bias.numpy()) if w.bias is not None else "zeros",
+        )
+        self.pad = TFPad(w.padding, pad_mode(w)) if any(w.padding) else tf.identity
+
+    def call(self, inputs):
+        return self.conv(self.pad(inputs))
+
+
+class TFLinear(keras.layers.Layer):
+    # TF version of torch.nn.Linear(), applied to the last (channel) dimension
+    def __init__(self, w=None):
+        super().__init__()
+        self.linear = keras.layers.Dense(
+            w.out_features,
+            use_bias=w.bias is not None,
+            kernel_initializer=keras.initializers.Constant(w.weight.T.numpy()),
+            bias_initializer=keras.initializers.Constant(w.bias.numpy()) if w.bias is not None else "zeros",
+        )
+
+    def call(self, inputs):
+        return self.linear(inputs)
+
+
+class TFLayerNorm(keras.layers.Layer):
+    # TF version of torch.nn.LayerNorm() over channels, also SpatialIE LayerNorm with either data_format in NHWC
+    def __init__(self, w=None):
+        super().__init__()
+        self.ln = keras.layers.LayerNormalization(
+            epsilon=w.eps,
+            gamma_initializer=keras.initializers.Constant(w.weight.numpy()),
+            beta_initializer=keras.initializers.Constant(w.bias.numpy()),
+        )
+
+    def call(self, inputs):
+        return self.ln(inputs)
+
+
+def tf_conv2d(w):
+    # Returns TF substitute of a PyTorch nn.Conv2d(), depthwise if groups > 1
+    if w.groups > 1:
+        return TFDWConv2d(w=w)
+    return TFConv2d(w.in_channels, w.out_channels, w.kernel_size, w.stride, bias=w.bias is not None, w=w)
+
+
+class TFRFAConv(keras.layers.Layer):
+    # TF version of RFAConv, receptive-field attention convolution with BatchNorm2d() fused, see RFAConv.fuse()
+    def __init__(self, w=None):
+        super().__init__()
+        self.k, self.c = w.kernel_size, w.get_weight[1].in_channels
+        pool = w.get_weight[0]  # AvgPool2d(k, stride, k // 2) counting zero padding
+        self.get_weight = keras.Sequential(
+            [TFPad(pool.padding), keras.layers.AveragePooling2D(pool.kernel_size, pool.stride, "valid")]
+        )
+        self.weight_conv = tf_conv2d(w.get_weight[1])
+        self.generate_feature = tf_conv2d(w.generate_feature[0])
+        self.conv = tf_conv2d(w.conv[0])
+        self.act1, self.act2 = activations(w.generate_feature[-1]), activations(w.conv[-1])
+
+    def call(self, inputs):
+        k, c = self.k, self.c
+        weight = self.weight_conv(self.get_weight(inputs))  # (b,h,w,c*k*k)
+        h, w = weight.shape[1:3]
+        weight = tf.nn.softmax(tf.reshape(weight, [-1, h, w, c, k * k]), -1)
+        feature = tf.reshape(self.act1(self.generate_feature(inputs)), [-1, h, w, c, k * k])
+        x = tf.reshape(feature * weight, [-1, h, w, c, k, k])
+        x = tf.reshape(tf.transpose(x, [0, 1, 4, 2, 5, 3]), [-1, h * k, w * k, c])  # b h w c k k -> b (h k) (w k) c
+        return self.act2(self.conv(x))
+
+
+class TFAttention(keras.layers.Layer):
+    # TF version of SpatialIE channel Attention, tokens kept on axis 2 so q, k and v need no (c, hw) transposes
+    def __init__(self, w=None):
+        super().__init__()
+        self.heads = w.num_heads
+        self.temperature = tf.constant(w.temperature.numpy())  # (head,1,1)
+        self.qkv = tf_conv2d(w.qkv)
+        self.qkv_dwconv = tf_conv2d(w.qkv_dwconv)
+        self.project_out = tf_conv2d(w.project_out)
+
+    def call(self, inputs):
+        h, w, c = inputs.shape[1:]
+        qkv = tf.split(self.qkv_dwconv(self.qkv(inputs)), 3, axis=3)
+        q, k, v = (tf.transpose(tf.reshape(x, [-1, h * w, self.heads, c // self.heads]), [0, 2, 1, 3]) for x in qkv)
+        q, k = tf.math.l2_normalize(q, 2, 1e-24), tf.math.l2_normalize(k, 2, 1e-24)  # F.normalize(), eps 1e-12
+        attn = tf.nn.softmax(tf.matmul(q, k, transpose_a=True) * self.temperature)  # (b,head,c,c)
+        x = tf.matmul(v, attn, transpose_b=True)  # (b,head,hw,c)
+        return self.project_out(tf.reshape(tf.transpose(x, [0, 2, 1, 3]), [-1, h, w, c]))
+
+
+class TFMlp(keras.layers.Layer):
+    # TF version of SpatialIE Mlp, dropout removed for inference
+    def __init__(self, w=None):
+        super().__init__()
+        self.fc1, self.fc2 = TFLinear(w=w.fc1), TFLinear(w=w.fc2)
+        self.act = activations(w.act)
+
+    def call(self, inputs):
+        return self.fc2(self.act(self.fc1(inputs)))
+
+
+class TFKANLinear(keras.layers.Layer):
+    # TF version of KANLinear on (n, in_features) inputs, B-spline bases by the Cox-de Boor recursion
+    def __init__(self, w=None):
+        super().__init__()
+        g = w.grid  # (in, grid_size + 2 * spline_order + 1)
+        self.order = w.spline_order
+        self.grid = tf.constant(g.numpy())
+        # reciprocal knot spans of the left and right recursion terms, per order
+        self.left = [tf.constant((1 / (g[:, k:-1] - g[:, : -(k + 1)])).numpy()) for k in range(1, self.order + 1)]
+        self.right = [tf.constant((1 / (g[:, k + 1 :] - g[:, 1:-k])).numpy()) for k in range(1, self.order + 1)]
+        self.base_weight = tf.constant(w.base_weight.T.numpy())  # (in,out)
+        self.spline_weight = tf.constant(w.scaled_spline_weight.view(w.out_features, -1).T.numpy())  # (in*coeff,out)
+        self.act = activations(w.base_activation)
+
+    def call(self, inputs):
+        x, g = inputs[..., None], self.grid  # (n,in,1)
+        bases = tf.cast(tf.logical_and(x >= g[:, :-1], x < g[:, 1:]), x.dtype)
+        for k in range(1, self.order + 1):
+            bases = (x - g[:, : -(k + 1)]) * self.left[k - 1] * bases[..., :-1] + (
+                g[:, k + 1 :] - x
+            ) * self.right[k - 1] * bases[..., 1:]
+        bases = tf.reshape(bases, [-1, self.spline_weight.shape[0]])  # (n,in*coeff)
+        return tf.matmul(self.act(inputs), self.base_weight) + tf.matmul(bases, self.spline_weight)
+
+
+class TFKAN(keras.layers.Layer):
+    # TF version of KAN
+    def __init__(self, w=None):
+        super().__init__()
+        self.m = [TFKANLinear(w=x) for x in w.layers]
+
+    def call(self, inputs):
+        x = inputs
+        for m in self.m:
+            x = m(x)
+        return x
+
+
+class TFTransformerBlockBackbone(keras.layers.Layer):
+    # TF version of SpatialIE TransformerBlockBackbone
+    def __init__(self, w=None):
+        super().__init__()
+        self.norm1, self.attn = TFLayerNorm(w=w.norm1), TFAttention(w=w.attn)
+        self.norm2, self.mlp = TFLayerNorm(w=w.norm2), TFMlp(w=w.mlp)
+
+    def call(self, inputs):
+        x = inputs + self.attn(self.norm1(inputs))
+        return x + self.mlp(self.norm2(x))
+
+
+class TFKANsformer(keras.layers.Layer):
+    # TF version of SpatialIE KANsformer
+    def __init__(self, w=None):
+        super().__init__()
+        self.norm1, self.attn = TFLayerNorm(w=w.norm1), TFAttention(w=w.attn)
+        self.norm2, self.kan = TFLayerNorm(w=w.norm2), TFKAN(w=w.kan)
+
+    def call(self, inputs):
+        x = inputs + self.attn(self.norm1(inputs))
+        h, w, c = x.shape[1:]
+        return x + tf.reshape(self.kan(tf.reshape(self.norm2(x), [-1, c])), [-1, h, w, c])
+
+
+class TFDownsample(keras.layers.Layer):
+    # TF version of SpatialIE Downsample, conv and nn.PixelUnshuffle(2) with PyTorch channel order (c, dy, dx)
+    def __init__(self, w=None):
+        super().__init__()
+        self.conv = tf_conv2d(w.body[0])
+
+    def call(self, inputs):
+        x = tf.nn.space_to_depth(self.conv(inputs), 2)  # channel order (dy, dx, c)
+        h, w, c = x.shape[1:]
+        return tf.reshape(tf.transpose(tf.reshape(x, [-1, h, w, 4, c // 4]), [0, 1, 2, 4, 3]), [-1, h, w, c])
+
+
+class TFUpsampleShuffle(keras.layers.Layer):
+    # TF version of SpatialIE Upsample, conv and nn.PixelShuffle(2) with PyTorch channel order (c, dy, dx)
+    def __init__(self, w=None):
+        super().__init__()
+        self.conv = tf_conv2d(w.body[0])
+
+    def call(self, inputs):
+        x = self.conv(inputs)
+        h, w, c = x.shape[1:]
+        x = tf.reshape(tf.transpose(tf.reshape(x, [-1, h, w, c // 4, 4]), [0, 1, 2, 4, 3]), [-1, h, w, c])
+        return tf.nn.depth_to_space(x, 2)  # channel order (dy, dx, c)
+
+
+class TFGnconv(keras.layers.Layer):
+    # TF version of SpatialIE gnconv, recursive gated convolution
+    def __init__(self, w=None):
+        super().__init__()
+        self.dims, self.scale = w.dims, w.scale
+        self.proj_in, self.dwconv, self.proj_out = tf_conv2d(w.proj_in), tf_conv2d(w.dwconv), tf_conv2d(w.proj_out)
+        self.pws = [tf_conv2d(x) for x in w.pws]
+
+    def call(self, inputs):
+        pwa, abc = tf.split(self.proj_in(inputs), [self.dims[0], sum(self.dims)], 3)
+        dw = tf.split(self.dwconv(abc) * self.scale, self.dims, 3)
+        x = pwa * dw[0]
+        for i, pw in enumerate(self.pws):
+            x = pw(x) * dw[i + 1]
+        return self.proj_out(x)
+
+
+class TFGnBlock(keras.layers.Layer):
+    # TF version of SpatialIE GnBlock
+    def __init__(self, w=None):
+        super().__init__()
+        self.norm1, self.gnconv, self.norm2 = TFLayerNorm(w=w.norm1), TFGnconv(w=w.gnconv), TFLayerNorm(w=w.norm2)
+        self.pwconv1, self.pwconv2, self.act = TFLinear(w=w.pwconv1), TFLinear(w=w.pwconv2), activations(w.act)
+        self.gamma1 = 1.0 if w.gamma1 is None else tf.constant(w.gamma1.numpy())
+        self.gamma2 = 1.0 if w.gamma2 is None else tf.constant(w.gamma2.numpy())
+
+    def call(self, inputs):
+        x = inputs + self.gamma1 * self.gnconv(self.norm1(inputs))
+        return x + self.gamma2 * self.pwconv2(self.act(self.pwconv1(self.norm2(x))))
+
+
+class TFDFC(keras.layers.Layer):
+    # TF version of the reparameterized DFC gate, see DFC.fuse()
+    def __init__(self, w=None):
+        super().__init__()
+        assert hasattr(w, "row_bias"), "TFDFC() requires a fused DFC, see SpatialIE.deploy()"
+        self.pool = keras.layers.AveragePooling2D(2, 2, "valid")
+        self.conv, self.dwconv = tf_conv2d(w.short_conv[0]), tf_conv2d(w.short_conv[1])
+        self.row_bias = tf.constant(w.row_bias.permute(2, 3, 0, 1).numpy())  # (5,1,c,1)
+
+    def call(self, inputs):
+        h, w = inputs.shape[1:3]
+        x = self.dwconv(self.conv(self.pool(inputs)))
+        ones = tf.ones([1, x.shape[1], 1, x.shape[3]])  # border-dependent bias of the folded 1x5 stage
+        x = tf.sigmoid(x + tf.nn.depthwise_conv2d(ones, self.row_bias, [1, 1, 1, 1], "SAME"))
+        return tf.raw_ops.ResizeNearestNeighbor(images=x, size=(h, w), align_corners=False, half_pixel_centers=False)
+
+
+class TFHSI_DFC(keras.layers.Layer):
+    # TF version of SpatialIE HSI_DFC
+    def __init__(self, w=None):
+        super().__init__()
+        self.gnconv_part, self.dfc_part = TFGnBlock(w=w.gnconv_part), TFDFC(w=w.dfc_part)
+        self.post_conv = tf_conv2d(w.post_conv)
+
+    def call(self, inputs):
+        part1, part2 = tf.split(inputs, 2, 3)
+        part1 = self.gnconv_part(part1)
+        return self.post_conv(part1 * self.dfc_part(part2) + part1)
+
+
+class TFContentDrivenPromptBlock(keras.layers.Layer):
+    # TF version of SpatialIE ContentDrivenPromptBlock, prompt_param is a (1,h,w,prompt_dim) constant
+    def __init__(self, w=None):
+        super().__init__()
+        self.ca1, self.ca2 = tf_conv2d(w.ca.ca[0]), tf_conv2d(w.ca.ca[2])
+        self.sa = tf_conv2d(w.sa.sa)
+        # pa2 is a groups=c conv over the channel shuffled [x, attn] interleave. Shuffled channels 2i, 2i+1 are
+        # interleave channels i, c+i, so pa2 is one depthwise conv over the interleave and a sum of its halves
+        pa2 = w.pa2.weight  # (c,2,7,7)
+        self.pa2_pad = TFPad(w.pa2.padding, pad_mode(w.pa2))
+        self.pa2 = keras.layers.DepthwiseConv2D(
+            kernel_size=pa2.shape[2:],
+            padding="VALID",
+            use_bias=False,
+            depthwise_initializer=keras.initializers.Constant(
+                torch.cat([pa2[:, 0], pa2[:, 1]]).permute(1, 2, 0)[..., None].numpy()
+            ),
+        )
+        self.pa2_bias = tf.constant(w.pa2.bias.numpy())
+        self.conv1x1, self.conv3x3, self.out_conv1 = tf_conv2d(w.conv1x1), tf_conv2d(w.conv3x3), tf_conv2d(w.out_conv1)
+        self.hsi_dfc = TFHSI_DFC(w=w.hsi_dfc)
+
+    def call(self, inputs, prompt_param):
+        h, w, c = inputs.shape[1:]
+        cattn = self.ca2(tf.nn.relu(self.ca1(tf.reduce_mean(inputs, [1, 2], keepdims=True)))) * inputs
+        sattn = self.sa(tf.concat([tf.reduce_mean(inputs, 3, True), tf.reduce_max(inputs, 3, True)], 3)) * inputs
+        x2 = tf.reshape(tf.stack([inputs, sattn + cattn], 4), [-1, h, w, 2 * c])  # [x1, attn1, x2, attn2, ...]
+        x2 = self.pa2(self.pa2_pad(x2))
+        prompt_weight = tf.sigmoid(self.conv1x1(x2[..., :c] + x2[..., c:] + self.pa2_bias))
+        if prompt_param.shape[1:3] != (h, w):
+            prompt_param = tf.image.resize(prompt_param, (h, w), "bilinear")  # F.interpolate(align_corners=False)
+        prompt = self.conv3x3(prompt_weight * prompt_param)
+        return self.hsi_dfc(self.out_conv1(tf.concat([inputs, prompt], 3)))
+
+
+class TFSpatialIE(keras.layers.Layer):
+    # TF version of the SpatialIE enhancer, the static inference graph of SpatialIE.deploy() without gating,
+    # streaming or tiling. Runs the scale<1 guided path with an exact antialiased downscale
+    def __init__(self, c1, c2, dim=4, prompt_inch=128, prompt_size=32, scale=1.0, levels=3, kan=True, w=None):
+        super().__init__()
+        w = w if w.deployed else deepcopy(w).deploy()  # fused BatchNorm2d() and frozen prompt chain
+        L = self.levels = w.levels
+        self.scale, self.stride, self.guide_r, self.guide_eps = w.scale, w.stride, w.guide_r, w.guide_eps
+        self.conv0 = TFRFAConv(w=w.conv0)
+        for i in (*range(1, L + 2), *range(8 - L, 8)):  # encoder conv1-conv4, decoder conv5-conv7
+            m = getattr(w, f"conv{i}")
+            block = TFKANsformer if isinstance(m, KANsformer) else TFTransformerBlockBackbone
+            setattr(self, f"conv{i}", block(w=m))
+        for i in range(1, L + 1):
+            setattr(self, f"down{i}", TFDownsample(w=getattr(w, f"down{i}")))
+            setattr(self, f"up{i}", TFUpsampleShuffle(w=getattr(w, f"up{i}")))
+            setattr(self, f"prompt{i}", TFContentDrivenPromptBlock(w=getattr(w, f"prompt{i}")))
+        for i in range(L, 1, -1):
+            setattr(self, f"halvechannels{4 - i}", tf_conv2d(getattr(w, f"halvechannels{4 - i}").conv))
+        self.toRGB = tf_conv2d(w.toRGB.conv)
+        self.prompts = [tf.constant(getattr(w, f"prompt_param_fused{i}").permute(0, 2, 3, 1).numpy()) for i in range(L)]
+
+    def call(self, inputs):
+        return self._forward_guided(inputs) if self.scale < 1 else self._forward_once(inputs)
+
+    def _forward_once(self, x):
+        L, skips = self.levels, []
+        x = self.conv0(x)
+        for i in range(1, L + 1):
+            x = getattr(self, f"conv{i}")(x)
+            skips.append(x)
+            x = getattr(self, f"down{i}")(x)
+        x = getattr(self, f"conv{L + 1}")(x)
+        for i, prompt in zip(range(L, 0, -1), self.prompts):  # prompts deepest first
+            x = getattr(self, f"up{i}")(getattr(self, f"prompt{i}")(x, prompt))
+            x = getattr(self, f"conv{8 - i}")(tf.concat([x, skips.pop()], 3))
+            if i > 1:
+                x = getattr(self, f"halvechannels{4 - i}")(x)
+        return self.toRGB(x)
+
+    def _forward_guided(self, x):
+        # See guided_upsample(), the antialiased bilinear downscale is applied as constant (out, in) matrices per axis
+        h, w = x.shape[1:3]
+        s, r = self.stride, self.guide_r
+        size = max(round(h * self.scale / s), 1) * s, max(round(w * self.scale / s), 1) * s
+        ry, rx = (tf.constant(self._resize_matrix(n, m)) for n, m in zip((h, w), size))
+        x_lr = tf.transpose(tf.matmul(tf.transpose(x, [0, 2, 3, 1]), ry, transpose_b=True), [0, 3, 2, 1])  # (b,h',c,w)
+        x_lr = tf.transpose(tf.matmul(x_lr, rx, transpose_b=True), [0, 1, 3, 2])  # (b,h',w',c)
+        y_lr = self._forward_once(x_lr)
+        box = lambda t: tf.nn.avg_pool2d(t, 2 * r + 1, 1, "SAME")  # SAME pooling excludes padding from the count
+        mean_x, mean_y = box(x_lr), box(y_lr)
+        a = (box(x_lr * y_lr) - mean_x * mean_y) / (box(x_lr * x_lr) - mean_x * mean_x + self.guide_eps)
+        b = mean_y - a * mean_x
+        a, b = tf.split(tf.image.resize(tf.concat([a, b], 3), (h, w), "bilinear"), 2, 3)
+        return a * x + b
+
+    @staticmethod
+    def _resize_matrix(n, m):
+        # (m, n) weights of F.interpolate(mode='bilinear', antialias=True) resizing one axis from n to m pixels
+        eye = torch.eye(n)[None, None]  # the other axis is unchanged, its weights are the identity
+        return F.interpolate(eye, (m, n), mode="bilinear", align_corners=False, antialias=True)[0, 0].numpy()
+
+
 def parse_model(d, ch, model, imgsz):  # model_dict, input_channels(3)
     LOGGER.info(f"\n{'':>3}{'from':>18}{'n':>3}{'params':>10}  {'module':<40}{'arguments':<30}")
     anchors, nc, gd, gw, ch_mul = (
@@ -450,6 +817,14 @@ def parse_model(d, ch, model, imgsz):  # model_dict, input_channels(3)
             args = [ch[f]]
         elif m is Concat:
             c2 = sum(ch[-1 if x == -1 else x + 1] for x in f)
+        elif m is SpatialIE:
+            c2 = ch[f]
+            if args:  # [dim, prompt_inch, prompt_size, scale, levels, kan], see models/yolo.py
+                levels = args[4] if len(args) > 4 else 3
+                args[0] = max(make_divisible(args[0] * gw, 2), 4)
+                if len(args) > 1:
+                    args[1] = make_divisible(args[1] * gw, 2**levels)
+            args = [c2, c2, *args]
         elif m in [Detect, Segment]:
             args.append([ch[x + 1] for x in f])
             if isinstance(args[1], int):  # number of anchors
@@ -596,10 +971,20 @@ def activations(act=nn.SiLU):
         return lambda x: x * tf.nn.relu6(x + 3) * 0.166666667
     elif isinstance(act, (nn.SiLU, SiLU)):
         return lambda x: keras.activations.swish(x)
+    elif isinstance(act, nn.ReLU):
+        return lambda x: keras.activations.relu(x)
+    elif isinstance(act, nn.GELU):
+        return lambda x: keras.activations.gelu(x, approximate=act.approximate == "tanh")
     else:
         raise Exception(f"no matching TensorFlow activation found for PyTorch activation {act}")
 
 
+def pad_mode(conv):
+    # Returns tf.pad() mode for a PyTorch nn.Conv2d() padding_mode
+    assert conv.padding_mode in ("zeros", "reflect"), f"no matching TensorFlow padding for {conv.padding_mode}"
+    return "reflect" if conv.padding_mode == "reflect" else "constant"
+
+
 def representative_dataset_gen(dataset, ncalib=100):
     # Representative dataset generator for use with converter.representative_dataset, returns a generator of np arrays
     for n, (path, img, im0s, vid_cap, string) in enumerate(dataset):
@@ -611,6 +996,7 @@ def representative_dataset_gen(dataset, ncalib=100):
             break
 
 
+@smart_inference_mode()
 def run(
     weights=ROOT / "yolov5s.pt",  # weights path
     imgsz=(640, 640),  # inference size h,w
@@ -628,6 +1014,14 @@ def run(
     tf_model = TFModel(cfg=model.yaml, model=model, nc=model.nc, imgsz=imgsz)
     _ = tf_model.predict(im)  # inference
 
+    # SpatialIE parity on random 0-1 images
+    for i, m in enumerate(model.model):
+        if isinstance(m, SpatialIE):
+            x = torch.rand(batch_size, m.conv0.get_weight[1].in_channels, *imgsz).permute(0, 2, 3, 1)  # BHWC
+            y = m(x.permute(0, 3, 1, 2)).permute(0, 2, 3, 1).numpy()
+            d = np.abs(tf_model.model.layers[i](x.numpy()).numpy() - y).max()
+            LOGGER.info(f"SpatialIE layer {i} PyTorch vs TensorFlow max abs diff {d:.3g}")
+
     # Keras model
     im = keras.Input(shape=(*imgsz, 3), batch_size=None if dynamic else batch_size)
     keras_model = keras.Model(inputs=im, outputs=tf_model.predict(im))
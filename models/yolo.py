@@ -142,11 +142,15 @@ class Segment(Detect):
 
 class BaseModel(nn.Module):
     # YOLOv5 base model
+    memory_format = torch.contiguous_format  # activation layout, see channels_last()
+
     def forward(self, x, profile=False, visualize=False):
         return self._forward_once(x, profile, visualize)  # single-scale inference, train
 
     def _forward_once(self, x, profile=False, visualize=False):
         y, dt = [], []  # outputs
+        if self.memory_format is torch.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)  # single layout change per network
         for m in self.model:
             if m.f != -1:  # if not from previous layer
                 x = y[m.f] if isinstance(m.f, int) else [x if j == -1 else y[j] for j in m.f]  # from earlier layers
@@ -160,7 +164,11 @@ class BaseModel(nn.Module):
 
     def _profile_one_layer(self, m, x, dt):
         c = m == self.model[-1]  # is final layer, copy input as inplace fix
-        o = thop.profile(m, inputs=(x.copy() if c else x,), verbose=False)[0] / 1e9 * 2 if thop else 0  # FLOPs
+        stages = m.profile(x, verbose=False) if isinstance(m, SpatialIE) else None  # per-stage enhancer breakdown
+        if stages:  # thop misses the Attention and KAN matmuls
+            o = stages[-1]["GFLOPs"]
+        else:
+            o = thop.profile(m, inputs=(x.copy() if c else x,), verbose=False)[0] / 1e9 * 2 if thop else 0  # FLOPs
         t = time_sync()
         for _ in range(10):
             m(x.copy() if c else x)
@@ -168,6 +176,8 @@ class BaseModel(nn.Module):
         if m == self.model[0]:
             LOGGER.info(f"{'time (ms)':>10s} {'GFLOPs':>10s} {'params':>10s}  module")
         LOGGER.info(f"{dt[-1]:10.2f} {o:10.2f} {m.np:10.0f}  {m.type}")
+        if stages:
+            m.print_profile(stages)
         if c:
             LOGGER.info(f"{sum(dt):10.2f} {'-':>10s} {'-':>10s}  Total")
 
@@ -178,11 +188,25 @@ class BaseModel(nn.Module):
                 m.conv = fuse_conv_and_bn(m.conv, m.bn)  # update conv
                 delattr(m, "bn")  # remove batchnorm
                 m.forward = m.forward_fuse  # update forward
+            elif isinstance(m, SpatialIE):
+                m.deploy()  # static enhancer graph
         self.info()
         return self
 
+    def channels_last(self, enabled=True):
+        # Run in torch.channels_last (NHWC) layout: weights are converted once, the input once in _forward_once()
+        self.memory_format = torch.channels_last if enabled else torch.contiguous_format
+        self.model.to(memory_format=self.memory_format)  # 4D weights only, Detect() grids are not layout tensors
+        return self
+
     def info(self, verbose=False, img_size=640):  # print model information
         model_info(self, verbose, img_size)
+        if verbose:  # per-stage SpatialIE breakdown
+            h, w = img_size if isinstance(img_size, list) else [img_size, img_size]
+            for m in self.model:
+                if isinstance(m, SpatialIE):
+                    p = next(m.parameters())
+                    m.profile(torch.zeros(1, self.yaml.get("ch", 3), h, w, device=p.device, dtype=p.dtype), n=1)
 
     def _apply(self, fn):
         # Apply to(), cpu(), cuda(), half() to model tensors that are not parameters or registered buffers
@@ -387,6 +411,14 @@ def parse_model(d, ch):  # model_dict, input_channels(3)
        
         # --------------PPHGNetV2--------------
 
+        elif m is SpatialIE:
+            c2 = ch[f]  # image in, enhanced image out
+            if args:  # [dim, prompt_inch, prompt_size, scale, levels, kan], dim and prompt_inch at width_multiple 1.0
+                levels = args[4] if len(args) > 4 else 3
+                args[0] = max(make_divisible(args[0] * gw, 2), 4)
+                if len(args) > 1:
+                    args[1] = make_divisible(args[1] * gw, 2 ** levels)
+            args = [c2, c2, *args]
         elif m is nn.BatchNorm2d:
             args = [ch[f]]
         elif m is Concat:
@@ -439,6 +471,7 @@ if __name__ == "__main__":
     parser.add_argument("--device", default="", help="cuda device, i.e. 0 or 0,1,2,3 or cpu")
     parser.add_argument("--profile", action="store_true", help="profile model speed")
     parser.add_argument("--line-profile", action="store_true", help="profile model speed layer by layer")
+    parser.add_argument("--save-profile", type=str, default="", help="save SpatialIE stage profile to *.csv or *.json")
     parser.add_argument("--test", action="store_true", help="test all yolo*.yaml")
     opt = parser.parse_args()
     opt.cfg = check_yaml(opt.cfg)  # check YAML
@@ -452,6 +485,9 @@ if __name__ == "__main__":
     # Options
     if opt.line_profile:  # profile layer by layer
         model(im, profile=True)
+        for m in model.model:
+            if opt.save_profile and isinstance(m, SpatialIE):
+                m.profile(im, save=opt.save_profile, verbose=False)
 
     elif opt.profile:  # profile forward-backward
         results = profile(input=im, ops=[model], n=3)
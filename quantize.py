@@ -0,0 +1,239 @@
+# YOLOv5 🚀 by Ultralytics, AGPL-3.0 license
+"""
+Post-training INT8 quantization of YOLOv5 and SpatialIE detectors for CPU inference, in PyTorch FX graph mode.
+
+Every detector layer with convolutions (Conv, C3, SPPF, ...) is one quantization unit, traced by FX with its Conv2d-
+BatchNorm2d pairs fused. Inside SpatialIE only the Conv2d and Linear layers are units, so the attention softmax and L2
+normalization, the KAN spline bases, the prompt sigmoid gates and the other elementwise ops stay FP32 between them.
+Detect stays FP32. Units are calibrated on --calib training images, then the sensitivity of each unit is measured as
+the SQNR (dB) of its INT8 output against its FP32 output on the same FP32 model activations. Units below --min-sqnr,
+and units FX cannot trace, convert or run, fall back to FP32. FP32 and INT8 models are then compared with val.py.
+
+Usage:
+    $ python quantize.py --weights yolov5s_SpatialIE.pt --data coco128.yaml --img 640
+    $ python quantize.py --weights yolov5s_SpatialIE.pt --data coco128.yaml --min-sqnr 25 --backend qnnpack  # ARM
+
+Outputs yolov5s_SpatialIE-int8.pt, usable with val.py and detect.py on CPU, and the yolov5s_SpatialIE-int8.csv unit
+sensitivity table.
+"""
+
+import argparse
+import csv
+import math
+import sys
+import warnings
+from copy import deepcopy
+from pathlib import Path
+
+import torch
+import torch.nn as nn
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+# ROOT = ROOT.relative_to(Path.cwd())  # relative
+
+from models.experimental import attempt_load
+from models.modules import SpatialIE
+from models.yolo import Detect
+from utils.compression import calibration_batches, compare_models
+from utils.general import LOGGER, check_dataset, check_img_size, colorstr, file_size, print_args
+from utils.torch_utils import smart_inference_mode
+
+
+def quant_units(model):
+    # Returns {name: (parent, attr)} of quantization units, detector conv layers and Conv2d/Linear inside SpatialIE
+    units = {}
+    for i, m in enumerate(model.model):
+        if isinstance(m, SpatialIE):
+            for k, x in m.named_modules():
+                if isinstance(x, (nn.Conv2d, nn.Linear)) and not k.startswith("myPromptParamGen"):  # chain frozen
+                    parent, _, attr = f"{i}.{k}".rpartition(".")
+                    units[f"{i}.{k}"] = model.model.get_submodule(parent), attr
+        elif not isinstance(m, Detect) and any(isinstance(x, nn.Conv2d) for x in m.modules()):
+            units[str(i)] = model.model, str(i)
+    return units
+
+
+def swap(parent, attr, m):
+    # Replace parent.attr by m, keeping YOLOv5 layer routing attributes, returns the replaced module
+    old = getattr(parent, attr)
+    for k in "i", "f", "type", "np":
+        if hasattr(old, k):
+            setattr(m, k, getattr(old, k))
+    setattr(parent, attr, m)
+    return old
+
+
+def sqnr(signal, noise):
+    # Signal to quantization noise ratio (dB) from accumulated squared norms
+    return 10 * math.log10(signal / noise) if noise > 0 else float("inf")
+
+
+def raw_output(model, im):
+    # Detect outputs before the sigmoid, flattened per image
+    return torch.cat([x.flatten(1) for x in model(im)[1]], 1).float()
+
+
+def quantize_model(model, im, calib, sens, backend="x86", min_sqnr=20.0, prefix=colorstr("quantize:")):
+    """
+    Quantize FP32 `model` in place with FX post-training quantization. `im` is an example input, `calib` and `sens`
+    iterables of 0-1 image batches for calibration and sensitivity analysis. Returns (unit, module, SQNR dB, status)
+    rows, status is 'int8' or the reason for the FP32 fallback.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    warnings.filterwarnings("ignore", category=DeprecationWarning, module="torch.ao.quantization")  # torchao notice
+    torch.backends.quantized.engine = backend
+    qconfig_mapping = get_default_qconfig_mapping(backend)
+    units = quant_units(model)
+    types = {k: type(getattr(*u)).__name__ for k, u in units.items()}
+
+    # Example inputs, units that do not run are left FP32
+    args = {}
+    hook = lambda k: lambda m, a: args.setdefault(k, tuple(x[:1] for x in a))
+    handles = [getattr(*u).register_forward_pre_hook(hook(k)) for k, u in units.items()]
+    model(im[:1])
+    for h in handles:
+        h.remove()
+
+    # Insert observers and calibrate
+    status, prepared, quantized, stats = {}, {}, {}, {}
+    for k, (parent, attr) in units.items():
+        if k not in args:
+            status[k] = "fp32, not run"
+            continue
+        m = getattr(parent, attr)
+        try:
+            root = m if parent is model.model else nn.Sequential(m)  # SpatialIE layers are traced as leaf modules
+            prepared[k] = prepare_fx(deepcopy(root), qconfig_mapping, args[k])
+        except Exception as e:
+            status[k] = f"fp32, FX trace failed ({type(e).__name__})"
+    originals = {k: swap(*units[k], m) for k, m in prepared.items()}
+    for x in calib:
+        model(x)
+    for k, m in originals.items():
+        swap(*units[k], m)
+    for k, m in prepared.items():
+        try:
+            quantized[k] = convert_fx(m)
+        except Exception as e:
+            status[k] = f"fp32, convert failed ({type(e).__name__})"
+
+    # Sensitivity, each INT8 unit runs on the inputs of its FP32 counterpart in an FP32 forward pass
+    def measure(k):
+        def hook(m, a, y):
+            if k in status:
+                return
+            try:
+                yq = quantized[k](*a).float()
+            except Exception as e:
+                status[k] = f"fp32, INT8 run failed ({type(e).__name__})"
+                return
+            s, n = stats.get(k, (0.0, 0.0))
+            stats[k] = s + y.float().square().sum().item(), n + (yq - y.float()).square().sum().item()
+
+        return hook
+
+    handles = [getattr(*units[k]).register_forward_hook(measure(k)) for k in quantized]
+    for x in sens:
+        model(x)
+    for h in handles:
+        h.remove()
+
+    # Fall back to FP32 below min_sqnr, swap in the rest
+    rows = []
+    for k, u in units.items():
+        db = sqnr(*stats[k]) if k in stats else float("nan")
+        if k not in status:
+            status[k] = "int8" if db >= min_sqnr else f"fp32, SQNR < {min_sqnr:g} dB"
+        if status[k] == "int8":
+            swap(*u, quantized[k])
+        rows.append((k, types[k], db, status[k]))
+    n = sum(s == "int8" for s in status.values())
+    LOGGER.info(f"{prefix} {n}/{len(units)} units INT8 ({backend} backend), {len(units) - n} FP32 fallbacks")
+    return rows
+
+
+@smart_inference_mode()
+def run(
+    weights=ROOT / "yolov5s.pt",  # weights path
+    data=ROOT / "data/coco128.yaml",  # dataset.yaml path
+    imgsz=640,  # inference size (pixels)
+    batch_size=8,  # calibration and val batch size
+    calib=256,  # calibration images from the train split
+    sens=16,  # sensitivity analysis images, the first calibration images
+    min_sqnr=20.0,  # units with an INT8 SQNR below this (dB) fall back to FP32
+    backend="x86",  # quantized engine, x86 or fbgemm (x86 CPUs), qnnpack (ARM CPUs)
+    workers=8,  # max dataloader workers
+    val=True,  # compare FP32 and INT8 accuracy and speed with val.py
+):
+    # Model, FP32 on CPU with SpatialIE deployed. Conv2d-BatchNorm2d pairs are left for FX to fuse
+    model = attempt_load(weights, device=torch.device("cpu"), fuse=False).eval()
+    for m in model.modules():
+        if isinstance(m, SpatialIE):
+            m.deploy()
+    gs = int(max(model.stride))
+    imgsz = check_img_size(imgsz, gs)
+    data = check_dataset(data)
+
+    # Calibration images
+    batches = calibration_batches(data["train"], imgsz, batch_size, gs, calib, workers)  # uint8
+    images = lambda b: (x.float() / 255 for x in b)  # uint8 to 0-1 float
+    ns = math.ceil(sens / batch_size)
+
+    # Quantize
+    fp32 = deepcopy(model)
+    im = next(images(batches))
+    rows = quantize_model(model, im, images(batches), images(batches[:ns]), backend, min_sqnr)
+    signal = noise = 0.0
+    for x in images(batches[:ns]):
+        y, yq = raw_output(fp32, x), raw_output(model, x)
+        signal, noise = signal + y.square().sum().item(), noise + (yq - y).square().sum().item()
+
+    # Sensitivity table, least robust units first
+    LOGGER.info(f"\n{'unit':>48}{'module':>12}{'SQNR (dB)':>12}  status")
+    for k, m, db, s in sorted(rows, key=lambda r: (math.isnan(r[2]), r[2])):
+        LOGGER.info(f"{k:>48}{m:>12}{db:>12.1f}  {s}")
+    f = Path(str(weights).replace(".pt", "-int8.pt"))
+    with open(f.with_suffix(".csv"), "w", newline="") as file:
+        w = csv.writer(file)
+        w.writerow(["unit", "module", "SQNR (dB)", "status"])
+        w.writerows(rows)
+
+    # Save, loads with attempt_load() like any checkpoint
+    torch.save({"model": model, "epoch": -1, "quantized": backend}, f)
+    s = f"model output SQNR {sqnr(signal, noise):.1f} dB, saved {f} ({file_size(f):.1f} MB)"
+    LOGGER.info(f"\n{colorstr('quantize:')} {s}")
+
+    # Report
+    compare_models({"FP32": fp32, "INT8": model}, im, data, imgsz, batch_size, gs, workers, val)
+    return f, rows
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--weights", type=str, default=ROOT / "yolov5s.pt", help="weights path")
+    parser.add_argument("--data", type=str, default=ROOT / "data/coco128.yaml", help="dataset.yaml path")
+    parser.add_argument("--imgsz", "--img", "--img-size", type=int, default=640, help="inference size (pixels)")
+    parser.add_argument("--batch-size", type=int, default=8, help="calibration and val batch size")
+    parser.add_argument("--calib", type=int, default=256, help="calibration images from the train split")
+    parser.add_argument("--sens", type=int, default=16, help="sensitivity analysis images")
+    parser.add_argument("--min-sqnr", type=float, default=20.0, help="FP32 fallback below this unit SQNR (dB)")
+    parser.add_argument("--backend", default="x86", help="quantized engine, x86, fbgemm or qnnpack")
+    parser.add_argument("--workers", type=int, default=8, help="max dataloader workers")
+    parser.add_argument("--no-val", action="store_false", dest="val", help="skip FP32 and INT8 val.py comparison")
+    opt = parser.parse_args()
+    print_args(vars(opt))
+    return opt
+
+
+def main(opt):
+    run(**vars(opt))
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
@@ -0,0 +1,38 @@
+# YOLOv5 🚀 by Ultralytics, AGPL-3.0 license
+"""
+Synthetic degradation tests.
+
+Usage:
+    $ python -m pytest tests/test_degradations.py
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+import torch
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+
+from utils.degradations.batch import BatchDegradation
+
+
+@pytest.mark.parametrize("k", ["fog", "rain", "lowlight", "all"])
+def test_batch_degradation(k):
+    # BatchDegradation on CPU keeps the batch shape, dtype and 0-1 range, and is reproducible under a fixed seed
+    hyp = {x: 1.0 for x in ("fog", "rain", "lowlight") if k in (x, "all")}
+    degrade = BatchDegradation(hyp)
+    torch.manual_seed(0)
+    im = torch.rand(4, 3, 64, 96)
+    y = []
+    for _ in range(2):
+        torch.manual_seed(1)
+        y.append(degrade(im))
+    assert y[0].shape == im.shape
+    assert y[0].dtype == im.dtype
+    assert 0 <= y[0].min() and y[0].max() <= 1
+    assert not torch.equal(y[0], im)
+    torch.testing.assert_close(y[0], y[1], rtol=0, atol=0)
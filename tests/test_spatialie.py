@@ -0,0 +1,172 @@
+# YOLOv5 🚀 by Ultralytics, AGPL-3.0 license
+"""
+SpatialIE numerical parity tests.
+
+Usage:
+    $ python -m pytest tests/test_spatialie.py
+"""
+
+import sys
+from copy import deepcopy
+from pathlib import Path
+
+import pytest
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+
+from models.modules.KAN import ChunkedKANLinear, KANLinear
+from models.modules.SpatialIE import DFC, ChunkedChannelAttention, RFAConv, SpatialIE
+from utils.torch_utils import ModelEMA
+
+
+def randomize_bn(model):
+    # Non-trivial BatchNorm2d statistics and affine parameters, so that fusing them is not an identity
+    with torch.no_grad():
+        for m in model.modules():
+            if isinstance(m, nn.BatchNorm2d):
+                m.running_mean.uniform_(-0.5, 0.5)
+                m.running_var.uniform_(0.5, 2.0)
+                m.weight.uniform_(0.5, 1.5)
+                m.bias.uniform_(-0.5, 0.5)
+    return model
+
+
+@torch.no_grad()
+def test_fuse_blocks():
+    # RFAConv and DFC Conv-BN reparameterization, DFC on a non-square input to cover the border rows of the 1x5 bias
+    torch.manual_seed(0)
+    for m, x in (RFAConv(4, 8), torch.rand(2, 4, 16, 24)), (DFC(4, 4), torch.rand(2, 4, 20, 28)):
+        m = randomize_bn(m).eval()
+        y = m(x)
+        m.fuse()
+        assert not any(isinstance(x, nn.BatchNorm2d) for x in m.modules())
+        torch.testing.assert_close(m(x), y, rtol=1e-4, atol=1e-5)
+
+
+@torch.no_grad()
+def test_fuse_spatialie():
+    # SpatialIE.deploy(), as called by BaseModel.fuse(), matches the unfused enhancer
+    torch.manual_seed(0)
+    model = randomize_bn(SpatialIE(3, 3, dim=4)).eval()
+    x = torch.rand(2, 3, 64, 64)
+    y = model(x)
+    fused = deepcopy(model).deploy()
+    torch.testing.assert_close(fused(x), y, rtol=1e-4, atol=1e-5)
+
+
+@torch.no_grad()
+def test_trace_spatialie():
+    # torch.jit.trace of the deployed enhancer, as used by export.py, matches the eager model on a second input
+    torch.manual_seed(0)
+    model = randomize_bn(SpatialIE(3, 3, dim=4)).eval()
+    x = torch.rand(2, 3, 64, 64)
+    traced = torch.jit.trace(deepcopy(model).deploy(), x)
+    x = torch.rand_like(x)
+    torch.testing.assert_close(traced(x), model(x), rtol=1e-4, atol=1e-5)
+
+
+def attention_reference(q, k, v, temperature):
+    # Unchunked channel attention of (b, head, c, n) tensors, as Attention.forward before chunking
+    attn = F.normalize(q, dim=-1) @ F.normalize(k, dim=-1).transpose(-2, -1)
+    return (attn * temperature).softmax(dim=-1) @ v
+
+
+def test_chunked_attention():
+    # ChunkedChannelAttention outputs and q, k, v, temperature gradients, n = 10 tokens in uneven chunks of 4
+    torch.manual_seed(0)
+    q, k, v = (torch.randn(2, 2, 3, 10, dtype=torch.float64, requires_grad=True) for _ in range(3))
+    temperature = torch.rand(2, 1, 1, dtype=torch.float64, requires_grad=True)
+    inputs = q, k, v, temperature
+    assert torch.autograd.gradcheck(lambda *x: ChunkedChannelAttention.apply(*x, 4), inputs)
+
+    y = ChunkedChannelAttention.apply(*inputs, 4)
+    y_ref = attention_reference(*inputs)
+    g = torch.randn_like(y)
+    torch.testing.assert_close(y, y_ref)
+    for a, b in zip(torch.autograd.grad(y, inputs, g), torch.autograd.grad(y_ref, inputs, g)):
+        torch.testing.assert_close(a, b)
+
+
+def test_chunked_kan_linear():
+    # ChunkedKANLinear outputs and input, base and spline weight gradients, 10 tokens in uneven chunks of 4,
+    # inputs partly outside grid_range [-1, 1]
+    torch.manual_seed(0)
+    layer = KANLinear(4, 3).double()
+    x = torch.rand(10, 4, dtype=torch.float64) * 2.4 - 1.2
+    inputs = tuple(t.detach().clone().requires_grad_() for t in (x, layer.base_weight, layer.scaled_spline_weight))
+    assert torch.autograd.gradcheck(lambda *x: ChunkedKANLinear.apply(*x, layer, 4), inputs)
+
+    y = ChunkedKANLinear.apply(*inputs, layer, 4)
+    y_ref = layer._forward_chunked(*inputs, chunk=0)  # plain autograd through the B-spline bases
+    g = torch.randn_like(y)
+    torch.testing.assert_close(y, y_ref)
+    for a, b in zip(torch.autograd.grad(y, inputs, g), torch.autograd.grad(y_ref, inputs, g)):
+        torch.testing.assert_close(a, b)
+
+
+@torch.no_grad()
+@pytest.mark.parametrize("spline_order", [1, 2, 3, 4])
+def test_b_splines_uniform(spline_order):
+    # Closed-form uniform B-spline bases match the Cox-de Boor recursion, inputs partly outside grid_range [-1, 1]
+    torch.manual_seed(0)
+    layer = KANLinear(4, 3, grid_size=5, spline_order=spline_order).double()
+    x = torch.rand(64, 4, dtype=torch.float64) * 2.4 - 1.2
+    assert layer.uniform_grid
+    torch.testing.assert_close(layer._b_splines_uniform(x), layer._b_splines_recursive(x))
+
+
+@torch.no_grad()
+def test_b_splines_nonuniform():
+    # Refit and directly written non-uniform grids fall back to the Cox-de Boor recursion
+    torch.manual_seed(0)
+    layer = KANLinear(4, 3).double()
+    x = torch.rand(64, 4, dtype=torch.float64) ** 3 * 2 - 1  # skewed towards -1, quantile knots are not equally spaced
+    layer.update_grid(x)
+    assert not layer.uniform_grid
+    torch.testing.assert_close(layer.b_splines(x), layer._b_splines_recursive(x))
+
+    layer = KANLinear(4, 3).double()
+    layer.grid.copy_(layer.grid ** 3)  # in place write, without calling _check_grid()
+    torch.testing.assert_close(layer.b_splines(x), layer._b_splines_recursive(x))
+    assert not layer.uniform_grid
+
+
+@torch.no_grad()
+def test_ema_kan_grid():
+    # A refit KAN grid is copied to the ModelEMA model, which then evaluates the recursive bases of the new grid
+    torch.manual_seed(0)
+    model = nn.Sequential(KANLinear(4, 3))
+    ema = ModelEMA(model)
+    x = torch.rand(64, 4) ** 3 * 2 - 1
+    model[0].update_grid(x)
+    ema.update(model)
+    layer = ema.ema[0]
+    assert torch.equal(layer.grid, model[0].grid)
+    assert not layer.uniform_grid
+    bases = layer._b_splines_recursive(x).view(x.size(0), -1)
+    y = F.linear(layer.base_activation(x), layer.base_weight)
+    y += F.linear(bases, layer.scaled_spline_weight.view(layer.out_features, -1))
+    torch.testing.assert_close(layer(x), y)
+
+
+@pytest.mark.parametrize("scale", [1.0, 0.5])
+def test_tf_parity(scale):
+    # TFSpatialIE with transferred weights matches SpatialIE, full resolution and scale<1 guided path
+    pytest.importorskip("tensorflow")
+    from models.tf import TFSpatialIE
+
+    torch.manual_seed(0)
+    model = randomize_bn(SpatialIE(3, 3, dim=4, scale=scale)).eval()
+    x = torch.rand(1, 3, 64, 96)
+    with torch.no_grad():
+        y = model(x).permute(0, 2, 3, 1).numpy()  # BHWC
+    tf_model = TFSpatialIE(3, 3, dim=4, scale=scale, w=model)
+    y_tf = tf_model(x.permute(0, 2, 3, 1).numpy()).numpy()
+    assert y_tf.shape == y.shape
+    assert abs(y_tf - y).max() < 1e-4
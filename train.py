@@ -46,11 +46,14 @@ ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 
 import val as validate  # for end-of-epoch mAP
 from models.experimental import attempt_load
+from models.modules import KAN, SpatialIE
 from models.yolo import Model
 from utils.autoanchor import check_anchors
 from utils.autobatch import check_train_batch_size
 from utils.callbacks import Callbacks
 from utils.dataloaders import create_dataloader
+from utils.degradations import HYP as DEGRADATION_HYP
+from utils.degradations.batch import BatchDegradation
 from utils.downloads import attempt_download, is_url
 from utils.general import (
     LOGGER,
@@ -189,6 +192,16 @@ def train(hyp, opt, device, callbacks):  # hyp is path/to/hyp.yaml or hyp dictio
     else:
         model = Model(cfg, ch=3, nc=nc, anchors=hyp.get("anchors")).to(device)  # create
     amp = check_amp(model)  # check AMP
+    if opt.checkpoint_enhancer:  # SpatialIE activation checkpointing, before AutoBatch so it profiles the savings
+        for m in model.modules():
+            if isinstance(m, SpatialIE):
+                m.checkpointing(opt.checkpoint_enhancer)
+                LOGGER.info(f"SpatialIE activation checkpointing: {opt.checkpoint_enhancer}")
+    if opt.kan_grid:  # KAN streaming grid adaptation
+        for m in model.modules():
+            if isinstance(m, KAN):
+                m.track_grid(opt.kan_grid)
+        LOGGER.info(f"KAN streaming grid adaptation every {opt.kan_grid} iterations")
 
     # Freeze
     freeze = [f"model.{x}." for x in (freeze if len(freeze) > 1 else range(freeze[0]))]  # layers to freeze
@@ -245,13 +258,14 @@ def train(hyp, opt, device, callbacks):  # hyp is path/to/hyp.yaml or hyp dictio
         LOGGER.info("Using SyncBatchNorm()")
 
     # Trainloader
+    degrader = BatchDegradation(hyp) if opt.degrade_batch else None  # fog, rain, low-light on batches, not in workers
     train_loader, dataset = create_dataloader(
         train_path,
         imgsz,
         batch_size // WORLD_SIZE,
         gs,
         single_cls,
-        hyp=hyp,
+        hyp={**hyp, "fog": 0.0, "rain": 0.0, "lowlight": 0.0} if degrader else hyp,
         augment=True,
         cache=None if opt.cache == "val" else opt.cache,
         rect=opt.rect,
@@ -351,6 +365,8 @@ def train(hyp, opt, device, callbacks):  # hyp is path/to/hyp.yaml or hyp dictio
             callbacks.run("on_train_batch_start")
             ni = i + nb * epoch  # number integrated batches (since train start)
             imgs = imgs.to(device, non_blocking=True).float() / 255  # uint8 to float32, 0-255 to 0.0-1.0
+            if degrader:
+                imgs = degrader(imgs)
 
             # Warmup
             if ni <= nw:
@@ -543,6 +559,16 @@ def parse_opt(known=False):
     parser.add_argument("--freeze", nargs="+", type=int, default=[0], help="Freeze layers: backbone=10, first3=0 1 2")
     parser.add_argument("--save-period", type=int, default=-1, help="Save checkpoint every x epochs (disabled if < 1)")
     parser.add_argument("--seed", type=int, default=0, help="Global training seed")
+    parser.add_argument(
+        "--checkpoint-enhancer",
+        nargs="?",
+        const="stage",
+        default="",
+        choices=["stage", "block"],
+        help="SpatialIE activation checkpointing granularity",
+    )
+    parser.add_argument("--degrade-batch", action="store_true", help="hyp fog/rain/lowlight on device batches")
+    parser.add_argument("--kan-grid", type=int, default=0, help="KAN grid refit interval (iterations), 0 to disable")
     parser.add_argument("--local_rank", type=int, default=-1, help="Automatic DDP Multi-GPU argument, do not modify")
 
     # Logger arguments
@@ -647,8 +673,17 @@ def main(opt, callbacks=Callbacks()):
             "fliplr": (True, 0.0, 1.0),  # image flip left-right (probability)
             "mosaic": (True, 0.0, 1.0),  # image mixup (probability)
             "mixup": (True, 0.0, 1.0),  # image mixup (probability)
-            "copy_paste": (True, 0.0, 1.0),
-        }  # segment copy-paste (probability)
+            "copy_paste": (True, 0.0, 1.0),  # segment copy-paste (probability)
+            "fog": (False, 0.0, 1.0),  # image fog (probability), utils/degradations
+            "fog_beta": (False, 0.0, 0.3),  # fog density (+/- 50%)
+            "fog_A": (False, 0.0, 0.66),  # fog atmospheric light (+/- 50%)
+            "rain": (False, 0.0, 1.0),  # image rain (probability)
+            "rain_value": (False, 0.0, 1000.0),  # rain streak density (+/- 50%)
+            "rain_length": (False, 2.0, 66.0),  # rain streak length (pixels, +/- 50%)
+            "rain_angle": (False, 0.0, 90.0),  # rain angle (+/- deg)
+            "lowlight": (False, 0.0, 1.0),  # image gamma low-light (probability)
+            "lowlight_gamma": (False, 1.0, 5.0),  # low-light gamma (+/- 50%)
+        }
 
         # GA configs
         pop_size = 50
@@ -665,6 +700,7 @@ def main(opt, callbacks=Callbacks()):
             hyp = yaml.safe_load(f)  # load hyps dict
             if "anchors" not in hyp:  # anchors commented in hyp.yaml
                 hyp["anchors"] = 3
+            hyp = {**DEGRADATION_HYP, **hyp}  # degradations off unless set in hyp.yaml
         if opt.noautoanchor:
             del hyp["anchors"], meta["anchors"]
         opt.noval, opt.nosave, save_dir = True, True, Path(opt.save_dir)  # only val/save final epoch
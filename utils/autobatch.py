@@ -11,7 +11,9 @@ from utils.torch_utils import profile
 
 
 def check_train_batch_size(model, imgsz=640, amp=True):
-    # Check YOLOv5 training batch size
+    # Check YOLOv5 training batch size, profiled with any activation checkpointing (i.e. SpatialIE) already enabled
+    if any(getattr(m, "checkpoint", False) for m in model.modules()):
+        LOGGER.info(f"{colorstr('AutoBatch: ')}Profiling with activation checkpointing enabled")
     with torch.cuda.amp.autocast(amp):
         return autobatch(deepcopy(model).train(), imgsz)  # compute optimal batch size
 
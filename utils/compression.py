@@ -0,0 +1,50 @@
+# YOLOv5 🚀 by Ultralytics, AGPL-3.0 license
+"""Calibration images and reference vs compressed model reports shared by quantize.py and distill.py."""
+
+import math
+from itertools import islice
+
+from utils.dataloaders import create_dataloader
+from utils.general import LOGGER, colorstr
+from utils.torch_utils import smart_inference_mode, time_sync
+
+
+def calibration_batches(path, imgsz, batch_size, stride, n, workers=8):
+    # Returns a list of shuffled uint8 image batches of at least n images from dataset split path
+    loader = create_dataloader(
+        path, imgsz, batch_size, stride, pad=0.5, workers=workers, prefix=colorstr("calib: "), shuffle=True
+    )[0]
+    return [x for x, *_ in islice(loader, math.ceil(n / batch_size))]
+
+
+@smart_inference_mode()
+def latency(model, im, n=10):
+    # Median batch-size 1 inference latency (ms), without autograd so every model takes its inference path
+    model(im)  # warmup
+    t = []
+    for _ in range(n):
+        t0 = time_sync()
+        model(im)
+        t.append((time_sync() - t0) * 1e3)
+    return sorted(t)[n // 2]
+
+
+def compare_models(models, im, data, imgsz, batch_size, stride, workers=8, val=True):
+    # Log latency on image im[:1] and, if val, val.py metrics of each {name: model}. Returns {name: [model, results]}
+    import val as validate  # scripts at ROOT import this module
+
+    results = {k: [m, latency(m, im[:1])] for k, m in models.items()}
+    if val:
+        loader = create_dataloader(
+            data["val"], imgsz, batch_size, stride, pad=0.5, rect=True, workers=workers, prefix=colorstr("val: ")
+        )[0]
+        for k, r in results.items():
+            LOGGER.info(f"\nValidating {k} model...")
+            metrics, _, t = validate.run(
+                data, batch_size, imgsz, model=r[0], dataloader=loader, half=False, plots=False
+            )
+            r += [*metrics[:4], t[1]]
+    LOGGER.info(f"\n{'model':>10}{'ms (b=1)':>11}{'P':>11}{'R':>11}{'mAP50':>11}{'mAP50-95':>11}{'ms/img':>11}")
+    for k, (_, *r) in results.items():
+        LOGGER.info(f"{k:>10}" + "".join(f"{x:>11.3g}" for x in r))
+    return results
@@ -36,6 +36,7 @@ from utils.augmentations import (
     mixup,
     random_perspective,
 )
+from utils.degradations import degrade
 from utils.general import (
     DATASETS_DIR,
     LOGGER,
@@ -767,6 +768,9 @@ class LoadImagesAndLabels(Dataset):
             labels[:, 1:5] = xyxy2xywhn(labels[:, 1:5], w=img.shape[1], h=img.shape[0], clip=True, eps=1e-3)
 
         if self.augment:
+            # Weather and low-light degradations, at training resolution
+            img = degrade(img, hyp)
+
             # Albumentations
             img, labels = self.albumentations(img, labels)
             nl = len(labels)  # update after albumentations
@@ -0,0 +1,75 @@
+# YOLOv5 🚀 by Ultralytics, AGPL-3.0 license
+"""
+Synthetic weather and low-light degradations, for training enhancer-augmented detectors.
+
+LoadImagesAndLabels applies degrade() to augmented training images after mosaic/letterbox and random_perspective, so
+they are synthesized at training resolution. Probabilities and parameters are read from the hyp YAML, missing keys
+default to HYP (all off):
+    fog: 0.3  # image fog (probability)
+    fog_beta: 0.1  # fog density (+/- 50%)
+    fog_A: 0.5  # fog atmospheric light 0-1 (+/- 50%)
+    rain: 0.3  # image rain (probability)
+    rain_value: 500  # rain streak density (+/- 50%)
+    rain_length: 40  # rain streak length (pixels, +/- 50%), < 66
+    rain_angle: 50  # rain angle (+/- deg)
+    lowlight: 0.3  # image gamma low-light (probability)
+    lowlight_gamma: 3.25  # low-light gamma (+/- 50%)
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+from .fog import add_fog, random_fog, transmission
+from .lowlight import add_lowlight, random_lowlight
+from .rain import RainBank, add_rain, bank_kernel, rain_kernel, rain_noise, rain_streaks, random_rain
+
+__all__ = (
+    "HYP",
+    "degrade",
+    "add_fog",
+    "random_fog",
+    "transmission",
+    "add_lowlight",
+    "random_lowlight",
+    "add_rain",
+    "rain_kernel",
+    "rain_noise",
+    "rain_streaks",
+    "random_rain",
+    "RainBank",
+    "bank_kernel",
+    "rain_bank",
+)
+
+HYP = {
+    "fog": 0.0,
+    "fog_beta": 0.1,
+    "fog_A": 0.5,
+    "rain": 0.0,
+    "rain_value": 500,
+    "rain_length": 40,
+    "rain_angle": 50,
+    "lowlight": 0.0,
+    "lowlight_gamma": 3.25,
+}
+
+
+@lru_cache(maxsize=4)
+def rain_bank(value, length, angle):
+    # Shared RainBank per (min, max) parameter ranges
+    return RainBank(value, length, angle)
+
+
+def degrade(im, hyp, rng=np.random):
+    # Random fog, rain and gamma low-light on uint8 BGR image im, each with its hyp probability, in that order.
+    # Zero probabilities draw no random numbers
+    h = {k: hyp.get(k, v) for k, v in HYP.items()}
+    r = lambda x: (x * 0.5, x * 1.5)  # +/- 50% range
+    if h["fog"] and rng.uniform() < h["fog"]:
+        im = random_fog(im, r(h["fog_beta"]), r(h["fog_A"]), center=0.25, rng=rng)
+    if h["rain"] and rng.uniform() < h["rain"]:
+        im = rain_bank(r(h["rain_value"]), r(h["rain_length"]), (-h["rain_angle"], h["rain_angle"]))(im, rng=rng)
+    if h["lowlight"] and rng.uniform() < h["lowlight"]:
+        im = random_lowlight(im, r(h["lowlight_gamma"]), rng=rng)
+    return im
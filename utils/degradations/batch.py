@@ -0,0 +1,81 @@
+# YOLOv5 🚀 by Ultralytics, AGPL-3.0 license
+"""
+Batched torch versions of the fog, rain and gamma low-light degradations, run on the collated training batch on its
+device (CUDA or CPU) instead of per image in the dataloader workers. Enabled by train.py --degrade-batch.
+"""
+
+import math
+
+import torch
+import torch.nn.functional as F
+
+from . import HYP
+from .rain import NOISE_KERNEL, bank_kernel
+
+
+class BatchDegradation:
+    # Fog, rain and gamma low-light on (b, 3, h, w) 0-1 image batches with per-image random parameters, same hyp keys,
+    # probabilities, ranges and order as degrade()
+    def __init__(self, hyp):
+        self.hyp = {k: hyp.get(k, v) for k, v in HYP.items()}
+
+    @staticmethod
+    def uniform(n, r, device):
+        # n samples from U(r[0], r[1]) as a (n, 1, 1, 1) tensor
+        return torch.empty(n, 1, 1, 1, device=device).uniform_(*r)
+
+    def fog(self, im):
+        # Atmospheric scattering with a broadcasted per-image transmission map, see fog.transmission()
+        n, _, h, w = im.shape
+        beta = self.uniform(n, (self.hyp["fog_beta"] * 0.5, self.hyp["fog_beta"] * 1.5), im.device)
+        A = self.uniform(n, (self.hyp["fog_A"] * 0.5, self.hyp["fog_A"] * 1.5), im.device)
+        cy = (self.uniform(n, (-0.25, 0.25), im.device) * h + h // 2).floor()
+        cx = (self.uniform(n, (-0.25, 0.25), im.device) * w + w // 2).floor()
+        y = torch.arange(h, device=im.device, dtype=im.dtype).view(1, 1, h, 1)
+        x = torch.arange(w, device=im.device, dtype=im.dtype).view(1, 1, 1, w)
+        d = math.sqrt(max(h, w)) - 0.04 * ((y - cy) ** 2 + (x - cx) ** 2).sqrt()  # (n, 1, h, w)
+        t = torch.exp(-beta * d)
+        return im * t + A * (1 - t)
+
+    def rain(self, im, alpha=0.9, width=5):
+        # Rain streaks, every image blurred by its own motion kernel in one grouped convolution, see rain.random_rain()
+        n, _, h, w = im.shape
+        value = self.uniform(n, (self.hyp["rain_value"] * 0.5, self.hyp["rain_value"] * 1.5), im.device)
+        noise = torch.rand(n, 1, h, w, device=im.device, dtype=im.dtype) * 256
+        noise = noise * (noise >= 256 - value * 0.01)
+        k = torch.tensor(NOISE_KERNEL, device=im.device, dtype=im.dtype).view(1, 1, 3, 3)
+        noise = F.conv2d(F.pad(noise, (1, 1, 1, 1), mode="reflect"), k)
+
+        # Kernels of different lengths centered on a common odd size, with cv2.filter2D anchors (length // 2) aligned
+        r = self.hyp["rain_length"]
+        lengths = torch.randint(int(r * 0.5), int(r * 1.5) + 1, (n,)).tolist()
+        angles = torch.empty(n).uniform_(-self.hyp["rain_angle"], self.hyp["rain_angle"]).tolist()
+        s = max(lengths) // 2 * 2 + 1
+        kernels = torch.zeros(n, 1, s, s)
+        for i, (length, angle) in enumerate(zip(lengths, angles)):
+            o = s // 2 - length // 2
+            kernels[i, 0, o : o + length, o : o + length] = torch.tensor(bank_kernel(length, angle, width))
+        p = s // 2
+        x = F.pad(noise.view(1, n, h, w), (p, p, p, p), mode="reflect")
+        rain = F.conv2d(x, kernels.to(im.device, im.dtype), groups=n).view(n, 1, h, w)
+
+        # Min-max stretch per image, then addWeighted(im, alpha, rain, 1 - alpha, 1)
+        lo, hi = rain.amin((2, 3), keepdim=True), rain.amax((2, 3), keepdim=True)
+        rain = (rain - lo) / (hi - lo).clamp(min=1e-6)
+        return (im * alpha + rain * (1 - alpha) + 1 / 255).clamp(0, 1)
+
+    def lowlight(self, im):
+        # Per-image gamma darkening
+        gamma = self.uniform(len(im), (self.hyp["lowlight_gamma"] * 0.5, self.hyp["lowlight_gamma"] * 1.5), im.device)
+        return im.clamp(0, 1) ** gamma
+
+    @torch.no_grad()
+    def __call__(self, im):
+        # Degrade a random subset of batch im (b, 3, h, w) per degradation probability, returns the new batch
+        for k in "fog", "rain", "lowlight":
+            p = self.hyp[k]
+            if p:
+                i = (torch.rand(len(im), device=im.device) < p).nonzero().flatten()
+                if len(i):
+                    im = im.index_copy(0, i, getattr(self, k)(im[i]))
+        return im
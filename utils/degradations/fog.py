@@ -0,0 +1,120 @@
+# YOLOv5 🚀 by Ultralytics, AGPL-3.0 license
+"""
+Fog synthesis by the atmospheric scattering model I = J * t + A * (1 - t), with transmission t = exp(-beta * d) and a
+pseudo-depth d = sqrt(max(h, w)) - 0.04 * (distance from the fog center), as in image_fog_effect.py.py.
+
+Usage - foggy copy of a directory, mirroring its tree:
+    $ python -m utils.degradations.fog --source ../datasets/coco/images --output ../datasets/coco_fog/images
+    $ python -m utils.degradations.fog --source path/ --output out/ --beta 0.08 0.16 --A 0.4 0.6 --center 0.2
+"""
+
+import argparse
+import glob
+import math
+from functools import lru_cache
+from multiprocessing.pool import Pool
+from pathlib import Path
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from utils.general import LOGGER, NUM_THREADS, TQDM_BAR_FORMAT, colorstr, print_args
+
+
+@lru_cache(maxsize=4)
+def _distance(h, w):
+    # Distance of every pixel of a (2h-1, 2w-1) canvas from its center, cropped to put the fog center anywhere in h x w
+    y = np.arange(1 - h, h, dtype=np.float32) ** 2
+    x = np.arange(1 - w, w, dtype=np.float32) ** 2
+    d = np.sqrt(y[:, None] + x)
+    d.flags.writeable = False
+    return d
+
+
+def transmission(h, w, beta=0.14, center=None):
+    # Transmission map (h, w) float32 for fog density beta and fog center (y, x), default the image center
+    cy, cx = center or (h // 2, w // 2)
+    cy, cx = min(max(int(cy), 0), h - 1), min(max(int(cx), 0), w - 1)
+    d = math.sqrt(max(h, w)) - 0.04 * _distance(h, w)[h - 1 - cy : 2 * h - 1 - cy, w - 1 - cx : 2 * w - 1 - cx]
+    return np.exp(-beta * d)
+
+
+def add_fog(im, beta=0.14, A=0.5, center=None):
+    # Return uint8 image im with fog of density beta, atmospheric light A (0-1, scalar or per channel), centered at
+    # pixel (y, x)
+    h, w = im.shape[:2]
+    t = transmission(h, w, beta, center)
+    t = t[..., None] if im.ndim == 3 else t
+    out = im * t + np.asarray(A, dtype=np.float32) * 255 * (1 - t)
+    return np.clip(out + 0.5, 0, 255).astype(np.uint8)
+
+
+def random_fog(im, beta=(0.05, 0.15), A=(0.4, 0.6), center=0.0, rng=np.random):
+    # add_fog() with beta and A drawn uniformly from their (min, max) ranges, and the fog center moved from the image
+    # center by up to +/- center of the image height and width
+    h, w = im.shape[:2]
+    cy, cx = rng.uniform(-center, center, 2) * (h, w) + (h // 2, w // 2) if center else (h // 2, w // 2)
+    return add_fog(im, rng.uniform(*beta), rng.uniform(*A), (int(cy), int(cx)))
+
+
+def _fog_file(args):
+    # Fog image file src into dst, returns src if it could not be read
+    src, dst, seed, kwargs = args
+    im = cv2.imread(src)
+    if im is None:
+        return src
+    cv2.imwrite(dst, random_fog(im, rng=np.random.default_rng(seed), **kwargs))
+
+
+def run(
+    source="",  # image directory (recursive)
+    output="",  # output directory, mirrors the source tree
+    beta=(0.14,),  # fog density, value or (min, max) range
+    A=(0.5,),  # atmospheric light 0-1, value or (min, max) range
+    center=0.0,  # fog center offset from the image center, max fraction of height and width
+    workers=NUM_THREADS,  # processes
+    seed=0,  # random seed, fog parameters are reproducible per file
+):
+    from utils.dataloaders import IMG_FORMATS
+
+    source, output = Path(source).resolve(), Path(output).resolve()
+    assert source != output, "output must differ from source"
+    files = glob.glob(str(source / "**" / "*.*"), recursive=True)
+    files = sorted(x for x in files if x.split(".")[-1].lower() in IMG_FORMATS)
+    kwargs = {"beta": (beta[0], beta[-1]), "A": (A[0], A[-1]), "center": center}
+    jobs = []
+    for i, f in enumerate(files):
+        dst = output / Path(f).relative_to(source)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        jobs.append((f, str(dst), (seed, i), kwargs))
+    with Pool(workers) as pool:
+        pbar = tqdm(pool.imap_unordered(_fog_file, jobs, chunksize=4), total=len(jobs), bar_format=TQDM_BAR_FORMAT)
+        failed = [x for x in pbar if x]
+    for f in failed:
+        LOGGER.warning(f"WARNING ⚠️ could not read {f}")
+    LOGGER.info(f"{colorstr('fog:')} {len(jobs) - len(failed)} images saved to {output}")
+    return output
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", type=str, required=True, help="image directory (recursive)")
+    parser.add_argument("--output", type=str, required=True, help="output directory, mirrors the source tree")
+    parser.add_argument("--beta", type=float, nargs="+", default=[0.14], help="fog density, value or min max")
+    parser.add_argument("--A", type=float, nargs="+", default=[0.5], help="atmospheric light 0-1, value or min max")
+    parser.add_argument("--center", type=float, default=0.0, help="max fog center offset, fraction of image size")
+    parser.add_argument("--workers", type=int, default=NUM_THREADS, help="processes")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    opt = parser.parse_args()
+    print_args(vars(opt))
+    return opt
+
+
+def main(opt):
+    run(**vars(opt))
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
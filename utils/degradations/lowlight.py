@@ -0,0 +1,20 @@
+# YOLOv5 🚀 by Ultralytics, AGPL-3.0 license
+"""Low-light synthesis by gamma darkening, as in image_lowlight_effect.py.py."""
+
+import cv2
+import numpy as np
+
+
+def gamma_lut(gamma):
+    # uint8 lookup table of x -> 255 * (x / 255) ** gamma, truncated like np.uint8()
+    return (np.power(np.arange(256) / 255, gamma) * 255).astype(np.uint8)
+
+
+def add_lowlight(im, gamma=2.5):
+    # Return uint8 image im darkened by gamma > 1
+    return cv2.LUT(im, gamma_lut(gamma))
+
+
+def random_lowlight(im, gamma=(1.5, 5.0), rng=np.random):
+    # add_lowlight() with gamma drawn uniformly from its (min, max) range
+    return add_lowlight(im, rng.uniform(*gamma))
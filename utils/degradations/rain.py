@@ -0,0 +1,109 @@
+# YOLOv5 🚀 by Ultralytics, AGPL-3.0 license
+"""
+Rain streak synthesis, as in image_rain_effect.py.py: sparse noise is motion blurred along the rain direction and
+blended with the image.
+
+RainBank makes rain layers from precomputed parts instead: motion blur kernels come from a bank over quantized
+(length, angle, width), noise from a cached uniform field per resolution, and finished layers are reused as random
+crops and flips from a small per-resolution pool.
+"""
+
+from collections import OrderedDict
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+NOISE_KERNEL = np.array([[0, 0.1, 0], [0.1, 8, 0.1], [0, 0.1, 0]])  # initial blur of the noise dots
+
+
+def rain_noise(shape, value=500, rng=np.random):
+    # (h, w) float64 noise, uniform 0-256 values kept where above 256 - value / 100 and blurred, else 0
+    noise = rng.uniform(0, 256, shape[:2])
+    noise *= noise >= 256 - value * 0.01
+    return cv2.filter2D(noise, -1, NOISE_KERNEL)
+
+
+def rain_kernel(length=10, angle=0, width=1):
+    # (length, length) motion blur kernel: a diagonal rotated by angle - 45 degrees, shrunk by 1 - length / 100 and
+    # Gaussian blurred to the odd streak width. Use length < 100
+    trans = cv2.getRotationMatrix2D((length / 2, length / 2), angle - 45, 1 - length / 100.0)
+    k = cv2.warpAffine(np.diag(np.ones(length)), trans, (length, length))
+    return cv2.GaussianBlur(k, (width, width), 0)
+
+
+def rain_streaks(noise, kernel):
+    # uint8 (h, w) rain layer, noise motion blurred by kernel and stretched to 0-255
+    blurred = cv2.filter2D(noise, -1, kernel)
+    return cv2.normalize(blurred, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+
+
+def add_rain(im, rain, alpha=0.9):
+    # Return uint8 image im blended with the uint8 (h, w) rain layer, as seen through a wet window
+    return cv2.addWeighted(im, alpha, cv2.merge([rain] * im.shape[2]) if im.ndim == 3 else rain, 1 - alpha, 1)
+
+
+def random_rain(im, value=(300, 700), length=(20, 60), angle=(-50, 50), width=5, alpha=0.9, rng=np.random):
+    # add_rain() with noise value, streak length and angle drawn uniformly from their (min, max) ranges
+    kernel = rain_kernel(int(rng.uniform(length[0], length[1] + 1)), rng.uniform(*angle), int(width))
+    return add_rain(im, rain_streaks(rain_noise(im.shape, rng.uniform(*value), rng), kernel), alpha)
+
+
+@lru_cache(maxsize=2048)
+def _bank_kernel(length, angle, width):
+    k = rain_kernel(length, angle, width)
+    k.flags.writeable = False
+    return k
+
+
+def bank_kernel(length=10, angle=0, width=1, angle_step=2):
+    # Read-only rain_kernel() from the kernel bank, built on first use, with the angle quantized to angle_step degrees
+    return _bank_kernel(int(length), int(round(angle / angle_step) * angle_step), int(width))
+
+
+class RainBank:
+    # random_rain() from cached parts. Each resolution keeps a uniform noise field and a pool of `pool` rain layers,
+    # both 25% larger than the image. A call returns a random crop and flip of a pooled layer, and with probability
+    # `refresh` first replaces a pooled layer by a new one made from a flipped, shifted copy of the field, a random
+    # density threshold and a bank kernel. The last `sizes` resolutions are kept
+    def __init__(self, value=(300, 700), length=(20, 60), angle=(-50, 50), width=5, pool=16, refresh=0.1, sizes=4):
+        self.value, self.length, self.angle, self.width = value, length, angle, int(width)
+        self.pool, self.refresh, self.sizes = pool, refresh, sizes
+        self.cache = OrderedDict()  # (h, w): (noise field, [rain layers])
+
+    @staticmethod
+    def crop(x, h, w, rng):
+        # Random (h, w) crop of x with random flips, a view
+        i, j = int(rng.uniform(0, x.shape[0] - h + 1)), int(rng.uniform(0, x.shape[1] - w + 1))
+        x = x[i : i + h, j : j + w]
+        return x[::-1 if rng.uniform() < 0.5 else 1, ::-1 if rng.uniform() < 0.5 else 1]
+
+    def new_layer(self, field, rng):
+        # uint8 rain layer from a flipped, shifted copy of the cached field, as rain_streaks(rain_noise()) with random
+        # parameters
+        h, w = field.shape
+        shift = int(rng.uniform(0, h)), int(rng.uniform(0, w))
+        noise = np.roll(self.crop(field, h, w, rng), shift, (0, 1))  # flipped and circularly shifted copy
+        noise *= noise >= 256 - rng.uniform(*self.value) * 0.01
+        noise = cv2.filter2D(noise, -1, NOISE_KERNEL)
+        kernel = bank_kernel(rng.uniform(self.length[0], self.length[1] + 1), rng.uniform(*self.angle), self.width)
+        return rain_streaks(noise, kernel)
+
+    def layer(self, h, w, rng=np.random):
+        # uint8 (h, w) rain layer
+        key = h, w
+        if key not in self.cache:
+            self.cache[key] = rng.uniform(0, 256, (h * 5 // 4, w * 5 // 4)).astype(np.float32), []
+            if len(self.cache) > self.sizes:
+                self.cache.popitem(last=False)
+        self.cache.move_to_end(key)
+        field, layers = self.cache[key]
+        if len(layers) < self.pool:
+            layers.append(self.new_layer(field, rng))
+        elif rng.uniform() < self.refresh:
+            layers[int(rng.uniform(0, self.pool))] = self.new_layer(field, rng)
+        return self.crop(layers[int(rng.uniform(0, len(layers)))], h, w, rng)
+
+    def __call__(self, im, alpha=0.9, rng=np.random):
+        # Return uint8 image im with rain, as random_rain()
+        return add_rain(im, np.ascontiguousarray(self.layer(*im.shape[:2], rng)), alpha)
@@ -41,6 +41,15 @@ def smart_inference_mode(torch_1_9=check_version(torch.__version__, "1.9.0")):
     return decorate
 
 
+def is_compiling():
+    # True while torch.compile() traces the model (torch>=2.0)
+    compiler = getattr(torch, "compiler", None)
+    if hasattr(compiler, "is_compiling"):  # torch>=2.3
+        return compiler.is_compiling()
+    dynamo = getattr(torch, "_dynamo", None)
+    return bool(dynamo and dynamo.is_compiling())
+
+
 def smartCrossEntropyLoss(label_smoothing=0.0):
     # Returns nn.CrossEntropyLoss with label smoothing enabled for torch>=1.10.0
     if check_version(torch.__version__, "1.10.0"):
@@ -448,11 +457,16 @@ class ModelEMA:
         d = self.decay(self.updates)
 
         msd = de_parallel(model).state_dict()  # model state_dict
+        kans = {f"{n}.grid": m for n, m in self.ema.named_modules() if hasattr(m, "_check_grid")}  # KANLinear
         for k, v in self.ema.state_dict().items():
-            if v.dtype.is_floating_point:  # true for FP16 and FP32
+            if k in kans:  # copy KAN grids, an average of two grids does not match either set of spline weights
+                v.copy_(msd[k])
+            elif v.dtype.is_floating_point:  # true for FP16 and FP32
                 v *= d
                 v += (1 - d) * msd[k].detach()
         # assert v.dtype == msd[k].dtype == torch.float32, f'{k}: EMA {v.dtype} and model {msd[k].dtype} must be FP32'
+        for m in kans.values():
+            m._check_grid()
 
     def update_attr(self, model, include=(), exclude=("process_group", "reducer")):
         # Update EMA attributes
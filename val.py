@@ -37,6 +37,7 @@ if str(ROOT) not in sys.path:
 ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 
 from models.common import DetectMultiBackend
+from models.modules import SpatialIE
 from utils.callbacks import Callbacks
 from utils.dataloaders import create_dataloader
 from utils.general import (
@@ -122,7 +123,7 @@ def run(
     conf_thres=0.001,  # confidence threshold
     iou_thres=0.6,  # NMS IoU threshold
     max_det=300,  # maximum detections per image
-    task="val",  # train, val, test, speed or study
+    task="val",  # train, val, test, speed, study or gate
     device="",  # cuda device, i.e. 0 or 0,1,2,3 or cpu
     workers=8,  # max dataloader workers (per RANK in DDP mode)
     single_cls=False,  # treat as single-class dataset
@@ -143,6 +144,7 @@ def run(
     plots=True,
     callbacks=Callbacks(),
     compute_loss=None,
+    enhance_gate=0.0,  # SpatialIE bypass gate threshold, 0 to always enhance
 ):
     # Initialize/load model and set device
     training = model is not None
@@ -173,6 +175,10 @@ def run(
         # Data
         data = check_dataset(data)  # check
 
+    enhancers = [m for m in model.model.modules() if isinstance(m, SpatialIE)] if pt and enhance_gate else []
+    for m in enhancers:
+        m.gating(enhance_gate)  # route clean images around the enhancer
+
     # Configure
     model.eval()
     cuda = device.type != "cpu"
@@ -314,6 +320,9 @@ def run(
     if not training:
         shape = (batch_size, 3, imgsz, imgsz)
         LOGGER.info(f"Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS per image at shape {shape}" % t)
+    for m in enhancers:
+        n, nb = m.gate_stats
+        LOGGER.info(f"SpatialIE gate {enhance_gate:g}: {nb}/{n} images bypassed ({nb / max(n, 1):.1%})")
 
     # Plots
     if plots:
@@ -368,7 +377,7 @@ def parse_opt():
     parser.add_argument("--conf-thres", type=float, default=0.001, help="confidence threshold")
     parser.add_argument("--iou-thres", type=float, default=0.5, help="NMS IoU threshold")
     parser.add_argument("--max-det", type=int, default=300, help="maximum detections per image")
-    parser.add_argument("--task", default="test", help="train, val, test, speed or study")
+    parser.add_argument("--task", default="test", help="train, val, test, speed, study or gate")
     parser.add_argument("--device", default="", help="cuda device, i.e. 0 or 0,1,2,3 or cpu")
     parser.add_argument("--workers", type=int, default=8, help="max dataloader workers (per RANK in DDP mode)")
     parser.add_argument("--single-cls", action="store_true", help="treat as single-class dataset")
@@ -383,6 +392,9 @@ def parse_opt():
     parser.add_argument("--exist-ok", action="store_true", help="existing project/name ok, do not increment")
     parser.add_argument("--half", action="store_true", help="use FP16 half-precision inference")
     parser.add_argument("--dnn", action="store_true", help="use OpenCV DNN for ONNX inference")
+    parser.add_argument(
+        "--enhance-gate", nargs="+", type=float, default=[0.0], help="SpatialIE bypass gate threshold(s)"
+    )
     opt = parser.parse_args()
     opt.data = check_yaml(opt.data)  # check YAML
     opt.save_json |= opt.data.endswith("coco.yaml")
@@ -394,6 +406,8 @@ def parse_opt():
 def main(opt):
     check_requirements(ROOT / "requirements.txt", exclude=("tensorboard", "thop"))
 
+    gates = opt.enhance_gate if isinstance(opt.enhance_gate, list) else [opt.enhance_gate]
+    opt.enhance_gate = gates[0]  # one threshold except for --task gate
     if opt.task in ("train", "val", "test"):  # run normally
         if opt.conf_thres > 0.001:  # https://github.com/ultralytics/yolov5/issues/1466
             LOGGER.info(f"WARNING ⚠️ confidence threshold {opt.conf_thres} > 0.001 produces invalid results")
@@ -422,8 +436,23 @@ def main(opt):
                 np.savetxt(f, y, fmt="%10.4g")  # save
             subprocess.run(["zip", "-r", "study.zip", "study_*.txt"])
             plot_val_study(x=x)  # plot
+        elif opt.task == "gate":  # SpatialIE bypass gate accuracy vs throughput
+            # python val.py --task gate --data coco.yaml --weights yolov5s_SpatialIE.pt --enhance-gate 0 0.1 0.2 0.3 0.5
+            for opt.weights in weights:
+                f = f"gate_{Path(opt.data).stem}_{Path(opt.weights).stem}.txt"  # filename to save to
+                y = []
+                for opt.enhance_gate in gates:
+                    LOGGER.info(f"\nRunning {f} --enhance-gate {opt.enhance_gate:g}...")
+                    r, _, t = run(**vars(opt), plots=False)
+                    y.append((opt.enhance_gate, *r[:4], *t))  # threshold, P, R, mAP50, mAP50-95, times
+                np.savetxt(f, y, fmt="%10.4g")  # save
+                LOGGER.info(f"\n{'gate':>10}{'P':>11}{'R':>11}{'mAP50':>11}{'mAP50-95':>11}{'ms/img':>11}{'img/s':>11}")
+                for g, p, r, m50, m, *t in y:
+                    LOGGER.info(
+                        f"{g:>10.3g}{p:>11.4g}{r:>11.4g}{m50:>11.4g}{m:>11.4g}{sum(t):>11.1f}{1e3 / sum(t):>11.1f}"
+                    )
         else:
-            raise NotImplementedError(f'--task {opt.task} not in ("train", "val", "test", "speed", "study")')
+            raise NotImplementedError(f'--task {opt.task} not in ("train", "val", "test", "speed", "study", "gate")')
 
 
 if __name__ == "__main__":